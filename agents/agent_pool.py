@@ -0,0 +1,29 @@
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger("agent_pool")
+
+
+class AgentPool:
+    """
+    Process-wide registry of agent instances. Each agent is constructed once, on
+    first request, behind a lock, so concurrent Streamlit sessions share the same
+    instances (and their LLM clients) instead of racing to build their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Any] = {}
+
+    def get(self, name: str, factory: Callable[[], Any]) -> Any:
+        agent = self._agents.get(name)
+        if agent is None:
+            with self._lock:
+                # Double-checked: another thread may have built it while we waited
+                agent = self._agents.get(name)
+                if agent is None:
+                    agent = factory()
+                    self._agents[name] = agent
+                    logger.info(f"Initialized {name}")
+        return agent
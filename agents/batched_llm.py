@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import async_runtime
+
+logger = logging.getLogger("batched_llm")
+
+
+class BatchedChatOpenAI:
+    """
+    Wraps a LangChain chat model so that concurrent `invoke`/`ainvoke` calls from
+    all sessions are coalesced on the shared background event loop.
+
+    Requests arriving within `flush_ms` of each other are drained together (up to
+    `max_batch`) and sent concurrently. Requests are binned by prompt size so short
+    classification prompts are never held back behind long coaching prompts.
+    Streaming goes through `astream_text`; every other attribute (e.g. `stream`) is
+    delegated to the wrapped model.
+    """
+
+    def __init__(self, llm, max_batch: int = 16, flush_ms: int = 15, bin_limits: Sequence[int] = (2000, 8000)):
+        self.llm = llm
+        self.max_batch = max_batch
+        self.flush_seconds = flush_ms / 1000
+        self.bin_limits = tuple(bin_limits)
+        # Created lazily on the background loop, one queue per length bin
+        self._queues: Dict[int, asyncio.Queue] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.llm, name)
+
+    def invoke(self, messages: List[Any], **kwargs) -> Any:
+        return async_runtime.run(self._submit(messages, kwargs))
+
+    async def ainvoke(self, messages: List[Any], **kwargs) -> Any:
+        return await async_runtime.run_async(self._submit(messages, kwargs))
+
+    async def astream_text(self, messages: List[Any], on_token: Optional[Callable[[str], None]] = None, **kwargs) -> str:
+        """
+        Streams a completion on the background loop (where the shared async HTTP client
+        lives), calling `on_token` with each token, and returns the full text.
+        Streaming requests are not batched: each one needs its own response stream.
+        """
+        return await async_runtime.run_async(self._stream_text(messages, on_token, kwargs))
+
+    async def _stream_text(self, messages: List[Any], on_token: Optional[Callable[[str], None]], kwargs: Dict[str, Any]) -> str:
+        tokens = []
+        async for chunk in self.llm.astream(messages, **kwargs):
+            token = chunk.content
+            if not token:
+                continue
+            tokens.append(token)
+            if on_token:
+                on_token(token)
+        return "".join(tokens)
+
+    def _bin_for(self, messages: List[Any]) -> int:
+        size = sum(len(str(m.get("content", "") if isinstance(m, dict) else getattr(m, "content", m))) for m in messages)
+        for index, limit in enumerate(self.bin_limits):
+            if size <= limit:
+                return index
+        return len(self.bin_limits)
+
+    async def _submit(self, messages: List[Any], kwargs: Dict[str, Any]) -> Any:
+        """Runs on the background loop: enqueue the request and wait for its batch to finish."""
+        bin_index = self._bin_for(messages)
+        queue = self._queues.get(bin_index)
+        if queue is None:
+            queue = self._queues[bin_index] = asyncio.Queue()
+            asyncio.get_running_loop().create_task(self._drain(queue))
+
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((messages, kwargs, future))
+        return await future
+
+    async def _drain(self, queue: asyncio.Queue) -> None:
+        """Collects requests for up to `flush_seconds` (or `max_batch` items) and dispatches them together."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[Tuple[List[Any], Dict[str, Any], asyncio.Future]]) -> None:
+        if len(batch) > 1:
+            logger.info(f"Dispatching batch of {len(batch)} LLM requests")
+        results = await asyncio.gather(
+            *(self.llm.ainvoke(messages, **kwargs) for messages, kwargs, _ in batch),
+            return_exceptions=True
+        )
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
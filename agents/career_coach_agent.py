@@ -1,50 +1,17 @@
 # Enhanced Career Coach Agent with better chat handling
 
 import logging
-from typing import Dict, Any, List
-from langchain_openai import ChatOpenAI
+from typing import Dict, Any, List, Callable, Optional
 import json
-import re
+from agents.batched_llm import BatchedChatOpenAI
+from agents.llm_cache import SemanticCache
+from agents.llm_client import build_chat_model, build_embeddings
+from agents.llm_utils import JSON_RESPONSE_FORMAT, PROMPT_CACHE_MIN_TOKENS, ProfileDigestCache, count_tokens, build_conversation_context, extract_content, trim_history_to_budget
 
 logger = logging.getLogger("career_coach_agent")
 
-class CareerCoachAgent:
-    """Production-grade, GPT-powered LinkedIn Career Coach Agent with enhanced chat capabilities."""
-    
-    def __init__(self, openai_api_key: str):
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0.2,
-            openai_api_key=openai_api_key
-        )
-
-    def coach(self, profile: Dict[str, Any], job_description: str, session_id: str = None, 
-              missing_skills: list = None, user_question: str = None, chat_history: List[Dict] = None) -> Dict[str, Any]:
-        """Enhanced career coaching with better chat support and context awareness."""
-        
-        # If this is a chat interaction, handle it with better context
-        if user_question:
-            return self._handle_chat_interaction(profile, job_description, user_question, chat_history or [], session_id)
-        
-        # Standard coaching analysis
-        return self._provide_standard_coaching(profile, job_description, missing_skills, session_id)
-
-    def _handle_chat_interaction(self, profile: Dict[str, Any], job_description: str, 
-                                user_question: str, chat_history: List[Dict], session_id: str) -> Dict[str, Any]:
-        """Handle chat interactions with improved context and response formatting."""
-        
-        # Extract profile information
-        about = profile.get("about", "Not provided")
-        experience = profile.get("experience", [])
-        skills = profile.get("skills", [])
-        education = profile.get("education", [])
-        name = profile.get("name", "User")
-        
-        # Build conversation context
-        context = self._build_conversation_context(chat_history)
-        
-        # Enhanced system prompt for better responses
-        system_prompt = """You are an expert LinkedIn Career Coach and Personal Branding specialist. You have deep expertise in:
+# Static system prompt, kept byte-identical across calls so it forms a cacheable prompt prefix.
+SYSTEM_PROMPT_COACH = """You are an expert LinkedIn Career Coach and Personal Branding specialist. You have deep expertise in:
 
 - LinkedIn profile optimization and ATS compatibility
 - Career development and transition strategies  
@@ -67,39 +34,73 @@ Response Format:
 - Use markdown formatting for better readability
 - Include bullet points for actionable items
 - Add relevant emojis to make responses more engaging
-- Structure longer responses with clear headings"""
+- Structure longer responses with clear headings
 
-        # Build comprehensive user context
-        user_prompt = f"""**User Profile Context:**
-- Name: {name}
-- About: {about}
-- Experience: {self._format_experience(experience)}
-- Skills: {', '.join(skills) if skills else 'Not specified'}
-- Education: {self._format_education(education)}
+For every question, provide a helpful, detailed response that directly addresses it while leveraging the user's profile data and career context. Be specific and actionable."""
 
-**Target Job:** {job_description}
+class CareerCoachAgent:
+    """Production-grade, GPT-powered LinkedIn Career Coach Agent with enhanced chat capabilities."""
+    
+    def __init__(self, openai_api_key: str, llm=None):
+        # A shared model can be injected so agents reuse one connection pool and batch queue;
+        # calls are coalesced with other sessions' requests on the shared event loop
+        self.llm = llm or BatchedChatOpenAI(build_chat_model(openai_api_key, temperature=0.2))
+        self.cache = SemanticCache(build_embeddings(openai_api_key))
+        # Compact profile summaries, built once per session instead of every turn
+        self._profile_digests = ProfileDigestCache()
+
+    async def coach(self, profile: Dict[str, Any], job_description: str, session_id: str = None, 
+              missing_skills: list = None, user_question: str = None, chat_history: List[Dict] = None,
+              on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Enhanced career coaching with better chat support and context awareness.
+
+        For chat interactions, `on_token` (if given) is called with each response
+        token as it streams in, so the UI can render before the full answer is ready.
+        """
+        
+        # If this is a chat interaction, handle it with better context
+        if user_question:
+            return await self._handle_chat_interaction(profile, job_description, user_question, chat_history or [], session_id, on_token)
+        
+        # Standard coaching analysis
+        return await self._provide_standard_coaching(profile, job_description, missing_skills, session_id)
 
-**Conversation History:** {context}
+    async def _handle_chat_interaction(self, profile: Dict[str, Any], job_description: str, 
+                                user_question: str, chat_history: List[Dict], session_id: str,
+                                on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Handle chat interactions with improved context and response formatting."""
+        
+        # Build comprehensive user context (invariant profile data first, dynamic question last)
+        profile_context = self._profile_context(profile, job_description, session_id)
+
+        # Build conversation context, dropping the oldest messages if the prompt would exceed the token budget
+        context = self._build_conversation_context(
+            trim_history_to_budget(chat_history, profile_context + user_question)
+        )
 
-**Current Question:** {user_question}
+        user_prompt = f"""{profile_context}
 
-Please provide a helpful, detailed response that directly addresses their question while leveraging their profile data and career context. Be specific and actionable."""
+**Conversation History:** {context}
+
+**Current Question:** {user_question}"""
 
         try:
-            response = self.llm.invoke([
-                {"type": "system", "content": system_prompt},
-                {"type": "human", "content": user_prompt}
-            ])
-            
-            # Handle different response formats
-            if hasattr(response, 'content'):
-                content = response.content
-            elif hasattr(response, 'text'):
-                content = response.text
-            elif hasattr(response, 'message'):
-                content = response.message.content
+            # Near-duplicate questions about the same profile and job, asked in the same
+            # conversation context, are answered from the cache; follow-ups like "tell me
+            # more" depend on the history, so it is part of the bucket
+            cache_bucket = self.cache.fingerprint(SYSTEM_PROMPT_COACH, profile_context, context)
+            content, question_embedding = await self.cache.aget(cache_bucket, user_question)
+            if content is not None:
+                if on_token:
+                    on_token(content)
             else:
-                content = str(response)
+                # Stream the completion so the first tokens can be shown while the rest is generated
+                content = await self.llm.astream_text([
+                    {"type": "system", "content": SYSTEM_PROMPT_COACH},
+                    {"type": "human", "content": user_prompt}
+                ], on_token)
+                self.cache.put(cache_bucket, question_embedding, content, question=user_question)
             
             return {
                 "message": content.strip(),
@@ -121,74 +122,59 @@ Please provide a helpful, detailed response that directly addresses their questi
                 "success": False
             }
 
-    def _provide_standard_coaching(self, profile: Dict[str, Any], job_description: str, 
+    def _profile_context(self, profile: Dict[str, Any], job_description: str, session_id: str) -> str:
+        """Invariant part of the chat prompt; identical across turns of a session."""
+        return f"""**User Profile Context:**
+{self._profile_digests.get(profile, session_id)}
+
+**Target Job:** {job_description}"""
+
+    async def warm_prefill(self, profile: Dict[str, Any], job_description: str = None, session_id: str = None) -> None:
+        """
+        Send the invariant chat prompt prefix with `max_tokens=1` so the provider's
+        prompt cache already holds it when the real request for this session arrives.
+        Skipped when the prefix is too short to be cached at all.
+        """
+        profile_context = self._profile_context(profile, job_description, session_id)
+        if count_tokens(SYSTEM_PROMPT_COACH) + count_tokens(profile_context) < PROMPT_CACHE_MIN_TOKENS:
+            return
+        try:
+            await self.llm.ainvoke([
+                {"type": "system", "content": SYSTEM_PROMPT_COACH},
+                {"type": "human", "content": profile_context}
+            ], max_tokens=1)
+        except Exception as e:
+            logger.warning(f"Prefill warm-up failed for session {session_id}: {e}")
+
+    async def _provide_standard_coaching(self, profile: Dict[str, Any], job_description: str, 
                                   missing_skills: list, session_id: str) -> Dict[str, Any]:
         """Provide standard coaching analysis when not in chat mode."""
         
         about = profile.get("about", "")
-        experience = profile.get("experience", [])
+        formatted_experience = self._format_experience(profile.get("experience", []))
         skills = profile.get("skills", [])
         
+        # Skill-gap analysis and coaching share the same profile context, so when the
+        # caller has not supplied missing skills we ask for both in a single request.
         if missing_skills is None:
-            # Analyze missing skills first
-            missing_skills_prompt = f"""Analyze the following profile against this job description and identify missing or weak skills.
-
-Profile:
-- About: {about}
-- Experience: {self._format_experience(experience)}
-- Skills: {', '.join(skills)}
-
-Job Description: {job_description}
+            skills_instruction = """First, identify the missing or weak skills for the target job. Then produce guidance keyed against those skills.
 
-Return a JSON object with key 'missing_skills' containing an array of missing skills."""
+Provide detailed guidance as a single JSON object with these keys:
+- missing_skills: Array of missing or weak skills for the target job"""
+        else:
+            skills_instruction = f"""Missing Skills: {missing_skills}
 
-            try:
-                response = self.llm.invoke([
-                    {"type": "system", "content": "You are a skill gap analysis expert."},
-                    {"type": "human", "content": missing_skills_prompt}
-                ])
-                
-                # Handle different response formats
-                if hasattr(response, 'content'):
-                    result = response.content.strip()
-                elif hasattr(response, 'text'):
-                    result = response.text.strip()
-                elif hasattr(response, 'message'):
-                    result = response.message.content.strip()
-                else:
-                    result = str(response).strip()
-                
-                # Try to extract JSON from the response
-                try:
-                    # Look for JSON in the response
-                    json_match = re.search(r'\{.*\}', result, re.DOTALL)
-                    if json_match:
-                        json_str = json_match.group()
-                        parsed_result = json.loads(json_str)
-                        missing_skills = parsed_result.get("missing_skills", [])
-                    else:
-                        # If no JSON found, try to parse the whole response
-                        parsed_result = json.loads(result)
-                        missing_skills = parsed_result.get("missing_skills", [])
-                except json.JSONDecodeError:
-                    # If JSON parsing fails, extract skills from text
-                    missing_skills = self._extract_skills_from_text(result)
-            except Exception as e:
-                logger.warning(f"Failed to analyze missing skills: {e}")
-                missing_skills = []
+Provide detailed guidance in JSON format with these keys:"""
 
-        # Provide comprehensive coaching
         coaching_prompt = f"""As an expert career coach, provide comprehensive career guidance based on this profile and job target.
 
 Profile:
 - About: {about}
-- Experience: {self._format_experience(experience)}
+- Experience: {formatted_experience}
 - Skills: {', '.join(skills)}
 
 Target Job: {job_description}
-Missing Skills: {missing_skills}
-
-Provide detailed guidance in JSON format with these keys:
+{skills_instruction}
 - advice: Array of career advice points
 - growth_areas: Array of key areas for development
 - next_steps: Array of specific actionable steps
@@ -196,40 +182,19 @@ Provide detailed guidance in JSON format with these keys:
 - career_paths: Array of suggested career progression paths"""
 
         try:
-            response = self.llm.invoke([
+            # JSON mode guarantees a parseable object as long as it is not cut off; max_tokens
+            # bounds decode time while leaving room for all six keys and per-skill resource links
+            response = await self.llm.ainvoke([
                 {"type": "system", "content": "You are an expert career coach providing comprehensive guidance."},
                 {"type": "human", "content": coaching_prompt}
-            ])
-            
-            # Handle different response formats
-            if hasattr(response, 'content'):
-                result = response.content.strip()
-            elif hasattr(response, 'text'):
-                result = response.text.strip()
-            elif hasattr(response, 'message'):
-                result = response.message.content.strip()
-            else:
-                result = str(response).strip()
+            ], response_format=JSON_RESPONSE_FORMAT, max_tokens=1800)
             
-            try:
-                # Try to extract JSON from the response
-                json_match = re.search(r'\{.*\}', result, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group()
-                    coaching_data = json.loads(json_str)
-                else:
-                    # If no JSON found, try to parse the whole response
-                    coaching_data = json.loads(result)
-            except json.JSONDecodeError:
-                # If JSON parsing fails, create a fallback response
-                coaching_data = {
-                    "advice": ["Focus on developing your core skills and gaining relevant experience"],
-                    "growth_areas": ["Continue building your professional network and staying updated with industry trends"],
-                    "next_steps": ["Update your profile regularly and seek feedback from mentors"],
-                    "resources": {},
-                    "career_paths": ["Consider exploring different roles within your field"]
-                }
+            coaching_data = json.loads(extract_content(response))
             
+            # Echo caller-supplied skills; otherwise keep the ones the model identified
+            if missing_skills is not None:
+                coaching_data["missing_skills"] = missing_skills
+            coaching_data.setdefault("missing_skills", [])
             coaching_data["session_id"] = session_id
             coaching_data["success"] = True
             return coaching_data
@@ -249,28 +214,7 @@ Provide detailed guidance in JSON format with these keys:
 
     def _build_conversation_context(self, chat_history: List[Dict]) -> str:
         """Build conversation context from chat history."""
-        if not chat_history:
-            return "This is the beginning of our conversation."
-        
-        # Take last 3 exchanges to avoid token limits
-        recent_messages = chat_history[-6:]  # 3 user + 3 assistant messages
-        context_parts = []
-        
-        for msg in recent_messages:
-            if isinstance(msg, dict):
-                role = msg.get("role", "unknown")
-                content = msg.get("content", "")[:150]  # Limit content length
-                
-                if role == "user":
-                    context_parts.append(f"User: {content}")
-                elif role == "assistant":
-                    context_parts.append(f"Coach: {content}")
-            else:
-                # Fallback for other formats
-                content = str(msg)[:150]
-                context_parts.append(f"Message: {content}")
-        
-        return " | ".join(context_parts) if context_parts else "This is the beginning of our conversation."
+        return build_conversation_context(chat_history, "Coach")
 
     def _format_experience(self, experience: List[Dict]) -> str:
         """Format experience data for prompts."""
@@ -287,26 +231,3 @@ Provide detailed guidance in JSON format with these keys:
                 formatted.append(str(exp))
         
         return "; ".join(formatted)
-
-    def _format_education(self, education: List[Dict]) -> str:
-        """Format education data for prompts."""
-        if not education:
-            return "No education data provided"
-        
-        formatted = []
-        for edu in education:
-            if isinstance(edu, dict):
-                degree = edu.get("degree", "")
-                school = edu.get("school", "")
-                if degree or school:
-                    formatted.append(f"{degree} from {school}".strip())
-            else:
-                formatted.append(str(edu))
-        
-        return "; ".join(formatted[:2])  # Limit to 2 entries
-
-    def _extract_skills_from_text(self, text: str) -> list:
-        """Extract skills from text."""
-        # Implement your logic to extract skills from text here
-        # This is a placeholder and should be replaced with actual implementation
-        return []
\ No newline at end of file
@@ -1,38 +1,63 @@
 import logging
 from typing import Dict, Any, List
-from langchain_openai import ChatOpenAI
 import json
+from agents.batched_llm import BatchedChatOpenAI
+from agents.llm_cache import SemanticCache
+from agents.llm_client import build_chat_model, build_embeddings
+from agents.llm_utils import JSON_RESPONSE_FORMAT, PROMPT_CACHE_MIN_TOKENS, ProfileDigestCache, count_tokens, build_conversation_context, extract_content, trim_history_to_budget
 
 logger = logging.getLogger("content_enhancer_agent")
 
+# Static system prompt, kept byte-identical across calls so it forms a cacheable prompt prefix.
+SYSTEM_PROMPT_ENHANCER = """You are an expert LinkedIn content enhancer specializing in profile optimization and ATS (Applicant Tracking System) compatibility.
+
+Key Requirements:
+- Provide specific, actionable content improvements
+- Include relevant keywords for the target role
+- Use clear markdown formatting with headers and bullet points
+- Explain why each change improves the content
+- Focus on ATS optimization and readability
+- Be specific about the requested content section
+
+Response Format:
+1. **Current Content Analysis** - Brief assessment of existing content
+2. **Enhanced Version** - Improved content with keywords
+3. **Key Improvements** - Specific changes made and why
+4. **ATS Optimization Tips** - Additional suggestions for better visibility
+5. **Keywords Added** - List of relevant keywords incorporated
+
+When rewriting about sections, focus on:
+- Professional summary with key achievements
+- Relevant keywords for the target role
+- Clear value proposition
+- Call-to-action elements
+- Professional tone and readability
+
+For every request, provide specific content improvements that directly address it. Focus on the about section rewrite with relevant keywords for the target role. Include enhanced versions and explain why the changes are better."""
+
 class ContentEnhancerAgent:
     """Production-grade, GPT-powered LinkedIn Content Enhancement Agent."""
     
-    def __init__(self, openai_api_key: str):
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0.2,
-            openai_api_key=openai_api_key
-        )
-
-    def enhance(self, profile: Dict[str, Any], session_id: str = None, user_question: str = None, chat_history: List[Dict] = None) -> Dict[str, Any]:
+    def __init__(self, openai_api_key: str, llm=None):
+        # A shared model can be injected so agents reuse one connection pool and batch queue;
+        # calls are coalesced with other sessions' requests on the shared event loop
+        self.llm = llm or BatchedChatOpenAI(build_chat_model(openai_api_key, temperature=0.2))
+        self.cache = SemanticCache(build_embeddings(openai_api_key))
+        # Compact profile summaries, built once per session. The about section is the text
+        # being rewritten, so it is kept up to LinkedIn's 2,600-character limit.
+        self._profile_digests = ProfileDigestCache(about_chars=2600, description_chars=200)
+
+    async def enhance(self, profile: Dict[str, Any], session_id: str = None, user_question: str = None, chat_history: List[Dict] = None) -> Dict[str, Any]:
         """Enhance LinkedIn profile content and return improved versions."""
-        about = profile.get("about", "")
-        experience = profile.get("experience", [])
-        skills = profile.get("skills", [])
-        name = profile.get("name", "User")
-        
         # If this is a chat interaction, provide a conversational response
         if user_question:
-            return self._handle_chat_enhancement(profile, user_question, session_id, chat_history)
+            return await self._handle_chat_enhancement(profile, user_question, session_id, chat_history)
         
         # Standard content enhancement
         prompt = f"""Enhance this LinkedIn profile content to be more compelling and ATS-friendly.
 
 Profile:
-- About: {about}
-- Experience: {experience}
-- Skills: {skills}
+{self._profile_digests.get(profile, session_id)}
 
 Provide enhanced versions in JSON format with:
 - enhanced_about: improved about section
@@ -41,16 +66,12 @@ Provide enhanced versions in JSON format with:
 - tips: array of improvement tips"""
 
         try:
-            response = self.llm.invoke([
+            response = await self.llm.ainvoke([
                 {"type": "system", "content": "You are a LinkedIn content enhancement expert."},
                 {"type": "human", "content": prompt}
-            ])
+            ], response_format=JSON_RESPONSE_FORMAT)
             
-            result = response.content.strip()
-            try:
-                enhanced = json.loads(result)
-            except Exception:
-                enhanced = {"raw": result}
+            enhanced = json.loads(extract_content(response))
             
             logger.info(f"Content enhancement completed for session {session_id}")
             return enhanced
@@ -65,59 +86,34 @@ Provide enhanced versions in JSON format with:
                 "tips": ["Unable to enhance content due to an error"]
             }
 
-    def _handle_chat_enhancement(self, profile: Dict[str, Any], user_question: str, session_id: str, chat_history: List[Dict] = None) -> Dict[str, Any]:
+    async def _handle_chat_enhancement(self, profile: Dict[str, Any], user_question: str, session_id: str, chat_history: List[Dict] = None) -> Dict[str, Any]:
         """Handle chat-based content enhancement requests."""
-        about = profile.get("about", "")
-        experience = profile.get("experience", [])
-        skills = profile.get("skills", [])
-        name = profile.get("name", "User")
-        
-        # Build conversation context from chat history
-        context = self._build_conversation_context(chat_history or [])
-        
-        system_prompt = """You are an expert LinkedIn content enhancer specializing in profile optimization and ATS (Applicant Tracking System) compatibility.
+        profile_context = self._profile_context(profile, session_id)
 
-Key Requirements:
-- Provide specific, actionable content improvements
-- Include relevant keywords for the target role
-- Use clear markdown formatting with headers and bullet points
-- Explain why each change improves the content
-- Focus on ATS optimization and readability
-- Be specific about the requested content section
-
-Response Format:
-1. **Current Content Analysis** - Brief assessment of existing content
-2. **Enhanced Version** - Improved content with keywords
-3. **Key Improvements** - Specific changes made and why
-4. **ATS Optimization Tips** - Additional suggestions for better visibility
-5. **Keywords Added** - List of relevant keywords incorporated
-
-When rewriting about sections, focus on:
-- Professional summary with key achievements
-- Relevant keywords for the target role
-- Clear value proposition
-- Call-to-action elements
-- Professional tone and readability"""
+        # Build conversation context, dropping the oldest messages if the prompt would exceed the token budget
+        context = self._build_conversation_context(
+            trim_history_to_budget(chat_history or [], profile_context + user_question)
+        )
 
-        user_prompt = f"""**User Profile:**
-- Name: {name}
-- About: {about}
-- Experience: {experience}
-- Skills: {skills}
+        user_prompt = f"""{profile_context}
 
 **Conversation History:** {context}
 
-**User Question:** {user_question}
-
-Please provide specific content improvements that directly address their request. Focus on the about section rewrite with relevant keywords for their target role. Include enhanced versions and explain why the changes are better."""
+**User Question:** {user_question}"""
 
         try:
-            response = self.llm.invoke([
-                {"type": "system", "content": system_prompt},
-                {"type": "human", "content": user_prompt}
-            ])
-            
-            content = response.content if hasattr(response, 'content') else str(response)
+            # Near-duplicate requests about the same profile, in the same conversation
+            # context, are answered from the cache ("rewrite it shorter" depends on the history)
+            cache_bucket = self.cache.fingerprint(SYSTEM_PROMPT_ENHANCER, profile_context, context)
+            content, question_embedding = await self.cache.aget(cache_bucket, user_question)
+            if content is None:
+                response = await self.llm.ainvoke([
+                    {"type": "system", "content": SYSTEM_PROMPT_ENHANCER},
+                    {"type": "human", "content": user_prompt}
+                ])
+                
+                content = extract_content(response)
+                self.cache.put(cache_bucket, question_embedding, content, question=user_question)
             
             return {
                 "message": content.strip(),
@@ -137,27 +133,28 @@ Please provide specific content improvements that directly address their request
                 "success": False
             }
 
+    def _profile_context(self, profile: Dict[str, Any], session_id: str) -> str:
+        """Invariant part of the chat prompt; identical across turns of a session."""
+        return f"""**User Profile:**
+{self._profile_digests.get(profile, session_id)}"""
+
+    async def warm_prefill(self, profile: Dict[str, Any], job_description: str = None, session_id: str = None) -> None:
+        """
+        Send the invariant chat prompt prefix with `max_tokens=1` so the provider's
+        prompt cache already holds it when the real request for this session arrives.
+        Skipped when the prefix is too short to be cached at all.
+        """
+        profile_context = self._profile_context(profile, session_id)
+        if count_tokens(SYSTEM_PROMPT_ENHANCER) + count_tokens(profile_context) < PROMPT_CACHE_MIN_TOKENS:
+            return
+        try:
+            await self.llm.ainvoke([
+                {"type": "system", "content": SYSTEM_PROMPT_ENHANCER},
+                {"type": "human", "content": profile_context}
+            ], max_tokens=1)
+        except Exception as e:
+            logger.warning(f"Prefill warm-up failed for session {session_id}: {e}")
+
     def _build_conversation_context(self, chat_history: List[Dict]) -> str:
         """Build conversation context from chat history."""
-        if not chat_history:
-            return "This is the beginning of our conversation."
-        
-        # Take last 3 exchanges to avoid token limits
-        recent_messages = chat_history[-6:]  # 3 user + 3 assistant messages
-        context_parts = []
-        
-        for msg in recent_messages:
-            if isinstance(msg, dict):
-                role = msg.get("role", "unknown")
-                content = msg.get("content", "")[:150]  # Limit content length
-                
-                if role == "user":
-                    context_parts.append(f"User: {content}")
-                elif role == "assistant":
-                    context_parts.append(f"Assistant: {content}")
-            else:
-                # Fallback for other formats
-                content = str(msg)[:150]
-                context_parts.append(f"Message: {content}")
-        
-        return " | ".join(context_parts) if context_parts else "This is the beginning of our conversation." 
\ No newline at end of file
+        return build_conversation_context(chat_history) 
\ No newline at end of file
@@ -1,25 +1,19 @@
+import asyncio
 import logging
-from typing import Dict, Any
-from langchain_openai import ChatOpenAI
+import os
+from typing import Dict, Any, List
 import json
 import re
+from agents.batched_llm import BatchedChatOpenAI
+from agents.llm_cache import SemanticCache
+from agents.llm_client import build_chat_model, build_embeddings
+from agents.llm_utils import JSON_RESPONSE_FORMAT, extract_content
+from agents.local_intent_model import LocalIntentModel
 
 logger = logging.getLogger("intent_classifier_agent")
 
-class IntentClassifierAgent:
-    """Production-grade, GPT-powered Intent Classification Agent."""
-    
-    def __init__(self, openai_api_key: str):
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0.1,  # Lower temperature for more consistent classification
-            openai_api_key=openai_api_key
-        )
-
-    def classify_intent(self, user_question: str, session_id: str = None) -> Dict[str, Any]:
-        """Classify the user's intent and return the appropriate agent to handle it."""
-        
-        system_prompt = """You are an expert intent classifier for a LinkedIn Career Coach system. 
+# Static system prompt, kept byte-identical across calls so it forms a cacheable prompt prefix.
+SYSTEM_PROMPT_CLASSIFIER = """You are an expert intent classifier for a LinkedIn Career Coach system. 
 
 Your job is to analyze user questions and classify them into one of these categories:
 
@@ -42,94 +36,203 @@ Respond with ONLY a JSON object containing:
     "reasoning": "Brief explanation of why this agent was chosen"
 }
 
-Be precise. If the user is asking about their fit for the *target job*, use `job_fit_agent`. If they are asking about *other potential roles* or general guidance, use `career_coach_agent`."""
-
-        user_prompt = f"""Classify this user question: "{user_question}"
+Be precise. If the user is asking about their fit for the *target job*, use `job_fit_agent`. If they are asking about *other potential roles* or general guidance, use `career_coach_agent`.
 
 Return only the JSON response."""
 
-        try:
-            response = self.llm.invoke([
-                {"type": "system", "content": system_prompt},
-                {"type": "human", "content": user_prompt}
-            ])
-            
-            content = response.content if hasattr(response, 'content') else str(response)
-            
-            # Try to parse JSON from the response
-            try:
-                # Look for JSON in the response
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group()
-                    result = json.loads(json_str)
-                else:
-                    # If no JSON found, try to parse the whole response
-                    result = json.loads(content)
-                
-                # Validate the intent
-                valid_intents = [
-                    "profile_analyzer_agent", 
-                    "job_fit_agent", 
-                    "content_enhancer_agent", 
-                    "career_coach_agent"
-                ]
-                
-                if result.get("intent") not in valid_intents:
-                    logger.warning(f"Invalid intent '{result.get('intent')}' for session {session_id}, defaulting to career_coach_agent")
-                    result["intent"] = "career_coach_agent"
-                    result["confidence"] = 0.5
-                    result["reasoning"] = "Defaulted to career coach due to unclear intent"
-                
-                logger.info(f"Intent classified for session {session_id}: {result['intent']} (confidence: {result.get('confidence', 0)})")
-                
-                return {
-                    "intent": result["intent"],
-                    "confidence": result.get("confidence", 0.8),
-                    "reasoning": result.get("reasoning", "Classified based on question content"),
-                    "session_id": session_id,
-                    "success": True
-                }
-                
-            except json.JSONDecodeError:
-                # Fallback classification based on keywords
-                logger.warning(f"JSON parsing failed for session {session_id}, using keyword fallback")
-                return self._fallback_classification(user_question, session_id)
-            
-        except Exception as e:
-            logger.error(f"Error in intent classification for session {session_id}: {str(e)}")
-            return self._fallback_classification(user_question, session_id)
+# Keywords that signal each intent. Most questions are decided by these alone;
+# the LLM is only consulted when the keyword scores are ambiguous.
+INTENT_KEYWORDS = {
+    "profile_analyzer_agent": ["analyze", "strengths", "weaknesses", "profile analysis", "what are my"],
+    "job_fit_agent": ["job fit", "match", "requirements", "score", "how well", "fit for", "qualify"],
+    "content_enhancer_agent": ["rewrite", "enhance", "improve", "about section", "headline", "experience", "make my", "better"],
+    "career_coach_agent": ["career path", "career advice", "skills should", "develop", "other roles", "transition", "learn", "grow"],
+}
 
-    def _fallback_classification(self, user_question: str, session_id: str) -> Dict[str, Any]:
-        """Fallback classification using keyword matching when LLM fails."""
+# One alternation per intent, compiled once at import. Questions are lowercased
+# before matching, so the patterns stay case-sensitive.
+INTENT_PATTERNS = {
+    intent: re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")")
+    for intent, words in INTENT_KEYWORDS.items()
+}
+
+# Words that join two requests in one question, e.g. "analyze my profile and rewrite my headline".
+# Only such compound questions are fanned out to more than one agent.
+COMPOUND_PATTERN = re.compile(r"\b(?:and|also|plus|as well as)\b|[;&]")
+
+class IntentClassifierAgent:
+    """Production-grade, GPT-powered Intent Classification Agent."""
+
+    # Minimum lead the top intent needs over the runner-up to skip the LLM. Scores within
+    # 1 of each other go to the LLM, so a single generic keyword ("experience", "better",
+    # "match") never decides a question on its own.
+    KEYWORD_MARGIN = 2
+    # Keyword hits a further intent needs before a compound question fans out to it.
+    SECONDARY_INTENT_MIN_HITS = 2
+    
+    def __init__(self, openai_api_key: str, llm=None):
+        # A shared model can be injected so agents reuse one connection pool and batch queue;
+        # calls are coalesced with other sessions' requests on the shared event loop
+        self.llm = llm or BatchedChatOpenAI(build_chat_model(openai_api_key, temperature=0.1))  # Lower temperature for more consistent classification
+        self.cache = SemanticCache(build_embeddings(openai_api_key))
+        # Feature flag: setting INTENT_CLASSIFIER_MODEL_PATH replaces the OpenAI call for
+        # ambiguous questions with a local quantized model; leave it unset to keep OpenAI.
+        model_path = os.getenv("INTENT_CLASSIFIER_MODEL_PATH")
+        self.local_model = LocalIntentModel.load(model_path) if model_path else None
+
+    def score_intents(self, user_question: str) -> Dict[str, int]:
+        """Count keyword hits per intent, in INTENT_KEYWORDS priority order."""
         question = user_question.lower()
-        
-        # Profile analysis keywords
-        if any(word in question for word in ["analyze", "strengths", "weaknesses", "profile analysis", "what are my"]):
+        return {intent: len(pattern.findall(question)) for intent, pattern in INTENT_PATTERNS.items()}
+
+    def candidate_intents(self, user_question: str) -> List[str]:
+        """
+        Intents the classifier may still choose for this question: empty when the
+        keywords decide on their own, otherwise every intent tied for the top score
+        (all intents when no keyword matched).
+        """
+        scores = self.score_intents(user_question)
+        ranked = sorted(scores.values(), reverse=True)
+        if ranked[0] > 0 and ranked[0] - ranked[1] >= self.KEYWORD_MARGIN:
+            return []
+        return [intent for intent, score in scores.items() if score == ranked[0]]
+
+    def detect_intents(self, user_question: str, primary_intent: str) -> List[str]:
+        """
+        Every intent a compound question asks for, starting with the primary one.
+        Questions without a joining word always map to the primary intent alone, and
+        another intent is only added when it scores at least SECONDARY_INTENT_MIN_HITS,
+        since each one costs a whole extra agent call.
+        """
+        if not COMPOUND_PATTERN.search(user_question.lower()):
+            return [primary_intent]
+        return [primary_intent] + [
+            intent for intent, score in self.score_intents(user_question).items()
+            if intent != primary_intent and score >= self.SECONDARY_INTENT_MIN_HITS
+        ]
+
+    async def classify_intent(self, user_question: str, session_id: str = None) -> Dict[str, Any]:
+        """
+        Classify the user's intent and return the appropriate agent to handle it.
+        `intents` lists every agent a compound question needs, primary intent first.
+        """
+        result = await self._classify_primary(user_question, session_id)
+        result["intents"] = self.detect_intents(user_question, result["intent"])
+        if len(result["intents"]) > 1:
+            logger.info(f"Compound question for session {session_id}, intents: {result['intents']}")
+        return result
+
+    async def _classify_primary(self, user_question: str, session_id: str = None) -> Dict[str, Any]:
+        """Classify the single intent that best matches the question."""
+        scores = self.score_intents(user_question)
+        # sorted() is stable, so ties keep the INTENT_KEYWORDS priority order
+        (top_intent, top_score), (_, runner_up_score) = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:2]
+
+        if top_score > 0 and top_score - runner_up_score >= self.KEYWORD_MARGIN:
+            logger.info(f"Intent classified by keywords for session {session_id}: {top_intent} (scores: {scores})")
             return {
-                "intent": "profile_analyzer_agent",
-                "confidence": 0.7,
-                "reasoning": "Fallback: Contains profile analysis keywords",
+                "intent": top_intent,
+                "confidence": 0.8,
+                "reasoning": f"Matched {top_score} {top_intent} keyword(s)",
                 "session_id": session_id,
                 "success": True
             }
-        
-        # Job fit keywords
-        if any(word in question for word in ["job fit", "match", "requirements", "score", "how well", "fit for", "qualify"]):
+
+        if self.local_model is not None:
+            # Model inference is CPU-bound, so keep it off the event loop
+            local_result = await asyncio.to_thread(self._classify_locally, user_question, session_id)
+            if local_result:
+                return local_result
+
+        return await self._classify_with_llm(user_question, session_id)
+
+    def _classify_locally(self, user_question: str, session_id: str = None) -> Dict[str, Any]:
+        """Classify with the local model; returns None so the caller can fall back to the LLM."""
+        try:
+            intent, confidence = self.local_model.predict(user_question)
+        except Exception as e:
+            logger.warning(f"Local intent model failed for session {session_id}: {e}")
+            return None
+
+        if intent not in INTENT_KEYWORDS:
+            logger.warning(f"Local intent model returned unknown label '{intent}' for session {session_id}")
+            return None
+
+        logger.info(f"Intent classified locally for session {session_id}: {intent} (confidence: {confidence:.2f})")
+        return {
+            "intent": intent,
+            "confidence": confidence,
+            "reasoning": "Classified by local intent model",
+            "session_id": session_id,
+            "success": True
+        }
+
+    async def _classify_with_llm(self, user_question: str, session_id: str = None) -> Dict[str, Any]:
+        """Classify ambiguous questions with the LLM."""
+        user_prompt = f'Classify this user question: "{user_question}"'
+
+        try:
+            cache_bucket = self.cache.fingerprint(SYSTEM_PROMPT_CLASSIFIER)
+            cached_content, question_embedding = await self.cache.aget(cache_bucket, user_question)
+            if cached_content is not None:
+                content = cached_content
+            else:
+                # JSON mode guarantees a parseable object as long as it is not cut off; the cap
+                # leaves room for the pretty-printed object with its free-text "reasoning"
+                response = await self.llm.ainvoke([
+                    {"type": "system", "content": SYSTEM_PROMPT_CLASSIFIER},
+                    {"type": "human", "content": user_prompt}
+                ], response_format=JSON_RESPONSE_FORMAT, max_tokens=150)
+                
+                content = extract_content(response)
+            
+            result = json.loads(content)
+            
+            # Validate the intent
+            valid_intents = [
+                "profile_analyzer_agent", 
+                "job_fit_agent", 
+                "content_enhancer_agent", 
+                "career_coach_agent"
+            ]
+            
+            if result.get("intent") not in valid_intents:
+                logger.warning(f"Invalid intent '{result.get('intent')}' for session {session_id}, defaulting to career_coach_agent")
+                result["intent"] = "career_coach_agent"
+                result["confidence"] = 0.5
+                result["reasoning"] = "Defaulted to career coach due to unclear intent"
+            
+            logger.info(f"Intent classified for session {session_id}: {result['intent']} (confidence: {result.get('confidence', 0)})")
+            if cached_content is None:
+                self.cache.put(cache_bucket, question_embedding, content, question=user_question)
+            
             return {
-                "intent": "job_fit_agent",
-                "confidence": 0.7,
-                "reasoning": "Fallback: Contains job fit keywords",
+                "intent": result["intent"],
+                "confidence": result.get("confidence", 0.8),
+                "reasoning": result.get("reasoning", "Classified based on question content"),
                 "session_id": session_id,
                 "success": True
             }
-        
-        # Content enhancement keywords
-        if any(word in question for word in ["rewrite", "enhance", "improve", "about section", "headline", "experience", "make my", "better"]):
+            
+        except Exception as e:
+            logger.error(f"Error in intent classification for session {session_id}: {str(e)}")
+            return self._fallback_classification(user_question, session_id)
+
+    def guess_intent(self, user_question: str, session_id: str = None) -> Dict[str, Any]:
+        """Cheap keyword-only guess at the intent, used to start the likely agent early."""
+        return self._fallback_classification(user_question, session_id)
+
+    def _fallback_classification(self, user_question: str, session_id: str) -> Dict[str, Any]:
+        """Fallback classification using keyword matching when LLM fails."""
+        scores = self.score_intents(user_question)
+        # max() keeps the first of equal scores, so ties follow INTENT_KEYWORDS priority order
+        intent = max(scores, key=scores.get)
+
+        if scores[intent] > 0:
             return {
-                "intent": "content_enhancer_agent",
+                "intent": intent,
                 "confidence": 0.7,
-                "reasoning": "Fallback: Contains content enhancement keywords",
+                "reasoning": f"Fallback: Contains {intent} keywords",
                 "session_id": session_id,
                 "success": True
             }
@@ -141,4 +244,4 @@ Return only the JSON response."""
             "reasoning": "Fallback: Defaulted to career coach",
             "session_id": session_id,
             "success": True
-        } 
\ No newline at end of file
+        }
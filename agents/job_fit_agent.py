@@ -1,30 +1,63 @@
 import logging
-from typing import Dict, Any, List
-from langchain_openai import ChatOpenAI
+from typing import Dict, Any, List, Callable, Optional
 import json
+from agents.batched_llm import BatchedChatOpenAI
+from agents.llm_cache import SemanticCache
+from agents.llm_client import build_chat_model, build_embeddings
+from agents.llm_utils import JSON_RESPONSE_FORMAT, PROMPT_MAX_SKILLS, build_conversation_context, extract_content, parse_json_response, profile_prompt_block, summarize_experience
 
 logger = logging.getLogger("job_fit_agent")
 
+# Static system prompts, kept byte-identical across calls (and always the first message)
+# so they form a cacheable prompt prefix.
+SYSTEM_PROMPT_JOB_FIT_ANALYZE = "You are a job fit analysis expert."
+
+SYSTEM_PROMPT_JOB_FIT_CHAT = """You are an expert job fit analyst. When users ask about their job fit, provide detailed analysis with specific insights about their match with the target role. 
+
+Key Requirements:
+- Always provide a match score (0-100) at the beginning
+- Use clear markdown formatting with headers and bullet points
+- Be specific about strengths and areas for improvement
+- Include actionable recommendations
+- Be encouraging but honest about gaps
+- Consider the conversation history when providing analysis
+
+Response Format:
+1. Start with a clear match score and overall assessment
+2. List specific strengths that match the role
+3. Identify key gaps or areas for improvement
+4. Provide actionable recommendations
+5. End with a summary of fit potential"""
+
 class JobFitAgent:
     """Production-grade, GPT-powered Job Fit Analysis Agent."""
     
-    def __init__(self, openai_api_key: str):
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0.2,
-            openai_api_key=openai_api_key
-        )
-
-    def analyze(self, profile: Dict[str, Any], job_description: str, session_id: str = None, user_question: str = None, chat_history: List[Dict] = None) -> Dict[str, Any]:
-        """Analyze job fit and return match score and recommendations."""
-        about = profile.get("about", "")
-        experience = profile.get("experience", [])
-        skills = profile.get("skills", [])
-        name = profile.get("name", "User")
-        
+    # Chat questions shorter than this are answered by the smaller, faster model
+    SMALL_MODEL_MAX_QUESTION_CHARS = 80
+
+    def __init__(self, openai_api_key: str, llm=None, small_llm=None, small_model: str = "gpt-4o-mini"):
+        # Calls are coalesced with other sessions' (and other agents') requests on the
+        # shared event loop; pass shared models to batch with other agents
+        self.llm = llm or BatchedChatOpenAI(build_chat_model(openai_api_key, temperature=0.2))
+        self.small_llm = small_llm or BatchedChatOpenAI(build_chat_model(openai_api_key, model=small_model, temperature=0.2))
+        self.cache = SemanticCache(build_embeddings(openai_api_key))
+
+    async def analyze(self, profile: Dict[str, Any], job_description: str, session_id: str = None, user_question: str = None, chat_history: List[Dict] = None,
+                      on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Analyze job fit and return match score and recommendations.
+
+        For chat interactions, `on_token` (if given) is called with each response
+        token as it streams in, so the UI can render before the full answer is ready.
+        """
         # If this is a chat interaction, provide a conversational response
         if user_question:
-            return self._handle_chat_job_fit(profile, job_description, user_question, session_id, chat_history)
+            return await self._handle_chat_job_fit(profile, job_description, user_question, session_id, chat_history, on_token)
+        
+        about = profile.get("about", "")
+        experience = json.dumps(summarize_experience(profile.get("experience")), ensure_ascii=False, default=str)
+        skills = (profile.get("skills") or [])[:PROMPT_MAX_SKILLS]
+        name = profile.get("name", "User")
         
         # Standard job fit analysis
         prompt = f"""Analyze the fit between this profile and job description.
@@ -43,16 +76,20 @@ Provide analysis in JSON format with:
 - recommendations: array of improvement suggestions"""
 
         try:
-            response = self.llm.invoke([
-                {"type": "system", "content": "You are a job fit analysis expert."},
-                {"type": "human", "content": prompt}
-            ])
+            # Repeat analyses of the same profile and job description are served from the exact-match cache
+            cache_bucket = self.cache.fingerprint(SYSTEM_PROMPT_JOB_FIT_ANALYZE, prompt)
+            result, _ = await self.cache.aget(cache_bucket, "", semantic=False)
+            if result is None:
+                # JSON mode guarantees a parseable object
+                response = await self.llm.ainvoke([
+                    {"type": "system", "content": SYSTEM_PROMPT_JOB_FIT_ANALYZE},
+                    {"type": "human", "content": prompt}
+                ], response_format=JSON_RESPONSE_FORMAT)
+                
+                result = extract_content(response).strip()
             
-            result = response.content.strip()
-            try:
-                analysis = json.loads(result)
-            except Exception:
-                analysis = {"raw": result}
+            analysis = parse_json_response(result)
+            self.cache.put(cache_bucket, None, result, question="")
             
             logger.info(f"Job fit analysis completed for session {session_id}")
             return analysis
@@ -67,38 +104,17 @@ Provide analysis in JSON format with:
                 "recommendations": ["Unable to analyze job fit due to an error"]
             }
 
-    def _handle_chat_job_fit(self, profile: Dict[str, Any], job_description: str, user_question: str, session_id: str, chat_history: List[Dict] = None) -> Dict[str, Any]:
+    async def _handle_chat_job_fit(self, profile: Dict[str, Any], job_description: str, user_question: str, session_id: str, chat_history: List[Dict] = None,
+                                 on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """Handle chat-based job fit analysis requests."""
-        about = profile.get("about", "")
-        experience = profile.get("experience", [])
-        skills = profile.get("skills", [])
-        name = profile.get("name", "User")
+        # Rendered once at profile load, so every turn sends the same profile text
+        profile_block = profile_prompt_block(profile)
         
         # Build conversation context from chat history
         context = self._build_conversation_context(chat_history or [])
         
-        system_prompt = """You are an expert job fit analyst. When users ask about their job fit, provide detailed analysis with specific insights about their match with the target role. 
-
-Key Requirements:
-- Always provide a match score (0-100) at the beginning
-- Use clear markdown formatting with headers and bullet points
-- Be specific about strengths and areas for improvement
-- Include actionable recommendations
-- Be encouraging but honest about gaps
-- Consider the conversation history when providing analysis
-
-Response Format:
-1. Start with a clear match score and overall assessment
-2. List specific strengths that match the role
-3. Identify key gaps or areas for improvement
-4. Provide actionable recommendations
-5. End with a summary of fit potential"""
-
         user_prompt = f"""**User Profile:**
-- Name: {name}
-- About: {about}
-- Experience: {experience}
-- Skills: {skills}
+{profile_block}
 
 **Target Job:** {job_description}
 
@@ -109,12 +125,22 @@ Response Format:
 Please provide a detailed job fit analysis following the specified format. Include a clear match score and be specific about how well they match the role requirements."""
 
         try:
-            response = self.llm.invoke([
-                {"type": "system", "content": system_prompt},
-                {"type": "human", "content": user_prompt}
-            ])
-            
-            content = response.content if hasattr(response, 'content') else str(response)
+            # Same or near-duplicate questions about the same profile and job, in the same
+            # conversation context, are answered from the cache
+            cache_bucket = self.cache.fingerprint(SYSTEM_PROMPT_JOB_FIT_CHAT, profile_block, job_description or "", context)
+            content, question_embedding = await self.cache.aget(cache_bucket, user_question)
+            if content is not None:
+                if on_token:
+                    on_token(content)
+            else:
+                # Stream the completion so the first tokens can be shown while the rest is generated
+                # Short, simple questions do not need the larger model
+                llm = self.small_llm if len(user_question) < self.SMALL_MODEL_MAX_QUESTION_CHARS else self.llm
+                content = await llm.astream_text([
+                    {"type": "system", "content": SYSTEM_PROMPT_JOB_FIT_CHAT},
+                    {"type": "human", "content": user_prompt}
+                ], on_token)
+                self.cache.put(cache_bucket, question_embedding, content, question=user_question)
             
             return {
                 "message": content.strip(),
@@ -136,25 +162,4 @@ Please provide a detailed job fit analysis following the specified format. Inclu
 
     def _build_conversation_context(self, chat_history: List[Dict]) -> str:
         """Build conversation context from chat history."""
-        if not chat_history:
-            return "This is the beginning of our conversation."
-        
-        # Take last 3 exchanges to avoid token limits
-        recent_messages = chat_history[-6:]  # 3 user + 3 assistant messages
-        context_parts = []
-        
-        for msg in recent_messages:
-            if isinstance(msg, dict):
-                role = msg.get("role", "unknown")
-                content = msg.get("content", "")[:150]  # Limit content length
-                
-                if role == "user":
-                    context_parts.append(f"User: {content}")
-                elif role == "assistant":
-                    context_parts.append(f"Assistant: {content}")
-            else:
-                # Fallback for other formats
-                content = str(msg)[:150]
-                context_parts.append(f"Message: {content}")
-        
-        return " | ".join(context_parts) if context_parts else "This is the beginning of our conversation." 
\ No newline at end of file
+        return build_conversation_context(chat_history) 
\ No newline at end of file
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
+from cachetools import TTLCache
+
+import async_runtime
+
+logger = logging.getLogger("llm_cache")
+
+# Normalized embeddings keyed by sha256(model + text), shared by every SemanticCache in
+# the process: the classifier and the agent answering a turn embed the same question,
+# and a speculative run repeats it, so only the first lookup pays for an embedding call.
+_EMBED_CACHE: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_EMBED_CACHE_MAX_ENTRIES = 10_000
+_embed_cache_lock = threading.Lock()
+
+
+class SemanticCache:
+    """
+    In-process two-tier cache for LLM completions.
+
+    Entries are grouped into buckets keyed by an exact fingerprint of the prompt
+    context (system prompt, profile, target job, ...). A question repeated verbatim
+    (up to case and whitespace) is answered from an exact-match tier without any
+    embedding call. Otherwise, within a bucket, a question is answered from the cache
+    when its embedding has a cosine similarity of at least `threshold` with a
+    question that was already answered.
+    """
+
+    def __init__(self, embeddings, threshold: float = 0.95, max_buckets: int = 1024, max_entries_per_bucket: int = 128,
+                 max_exact_entries: int = 4096):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_buckets = max_buckets
+        self.max_entries_per_bucket = max_entries_per_bucket
+        self.max_exact_entries = max_exact_entries
+        # bucket -> (normalized question embeddings, cached responses), least recently used first
+        self._buckets: "OrderedDict[str, Tuple[List[np.ndarray], List[str]]]" = OrderedDict()
+        # sha256(bucket + canonical question) -> cached response, least recently used first
+        self._exact: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(*parts: str) -> str:
+        """Exact-match bucket key for the invariant parts of a prompt."""
+        return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _exact_key(bucket: str, question: str) -> str:
+        canonical = " ".join(question.lower().split())
+        return hashlib.sha256(f"{bucket}\x1f{canonical}".encode("utf-8")).hexdigest()
+
+    def get(self, bucket: str, question: str, semantic: bool = True) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Look up a cached response for `question` in `bucket`.
+
+        Returns the cached response (or None on a miss) together with the question
+        embedding, which should be passed to `put` after a miss so it is only computed once.
+        With `semantic=False` only the exact-match tier is consulted and no embedding is computed.
+        """
+        cached = self._get_exact(bucket, question)
+        if cached is not None or not semantic:
+            return cached, None
+        return self._lookup(bucket, self._embed(question))
+
+    async def aget(self, bucket: str, question: str, semantic: bool = True) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Async variant of `get`; the embedding request does not block the event loop."""
+        cached = self._get_exact(bucket, question)
+        if cached is not None or not semantic:
+            return cached, None
+        return self._lookup(bucket, await self._aembed(question))
+
+    def _get_exact(self, bucket: str, question: str) -> Optional[str]:
+        key = self._exact_key(bucket, question)
+        with self._lock:
+            response = self._exact.get(key)
+            if response is not None:
+                self._exact.move_to_end(key)
+                logger.info("Exact cache hit")
+            return response
+
+    def _lookup(self, bucket: str, embedding: Optional[np.ndarray]) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        if embedding is None:
+            return None, None
+
+        with self._lock:
+            entry = self._buckets.get(bucket)
+            if not entry:
+                return None, embedding
+            self._buckets.move_to_end(bucket)
+            vectors, responses = entry
+            similarities = np.stack(vectors) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                logger.info(f"Semantic cache hit (similarity {similarities[best]:.3f})")
+                return responses[best], embedding
+
+        return None, embedding
+
+    def put(self, bucket: str, embedding: Optional[np.ndarray], response: str, question: Optional[str] = None) -> None:
+        """
+        Store a response for the question whose embedding was returned by `get`.
+        Passing the `question` itself also stores it in the exact-match tier.
+        """
+        if not response:
+            return
+
+        with self._lock:
+            if question is not None:
+                key = self._exact_key(bucket, question)
+                self._exact[key] = response
+                self._exact.move_to_end(key)
+                while len(self._exact) > self.max_exact_entries:
+                    self._exact.popitem(last=False)
+            if embedding is None:
+                return
+            vectors, responses = self._buckets.setdefault(bucket, ([], []))
+            self._buckets.move_to_end(bucket)
+            vectors.append(embedding)
+            responses.append(response)
+            if len(vectors) > self.max_entries_per_bucket:
+                del vectors[0], responses[0]
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+
+    def _embedding_key(self, text: str) -> str:
+        model = getattr(self.embeddings, "model", "")
+        return hashlib.sha256(f"{model}\x1f{text}".encode("utf-8")).hexdigest()
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed and L2-normalize `text`; returns None if the embedding call fails."""
+        key = self._embedding_key(text)
+        cached = _cached_embedding(key)
+        if cached is not None:
+            return cached
+        try:
+            vector = self.embeddings.embed_query(text)
+        except Exception as e:
+            logger.warning(f"Embedding failed, skipping semantic cache: {e}")
+            return None
+        return _store_embedding(key, self._normalize(vector))
+
+    async def _aembed(self, text: str) -> Optional[np.ndarray]:
+        key = self._embedding_key(text)
+        cached = _cached_embedding(key)
+        if cached is not None:
+            return cached
+        try:
+            # The embeddings model shares the async HTTP client, which lives on the background loop
+            vector = await async_runtime.run_async(self.embeddings.aembed_query(text))
+        except Exception as e:
+            logger.warning(f"Embedding failed, skipping semantic cache: {e}")
+            return None
+        return _store_embedding(key, self._normalize(vector))
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+
+def _cached_embedding(key: str) -> Optional[np.ndarray]:
+    with _embed_cache_lock:
+        vector = _EMBED_CACHE.get(key)
+        if vector is not None:
+            _EMBED_CACHE.move_to_end(key)
+        return vector
+
+
+def _store_embedding(key: str, vector: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if vector is None:
+        return None
+    with _embed_cache_lock:
+        _EMBED_CACHE[key] = vector
+        _EMBED_CACHE.move_to_end(key)
+        while len(_EMBED_CACHE) > _EMBED_CACHE_MAX_ENTRIES:
+            _EMBED_CACHE.popitem(last=False)
+    return vector
+
+
+class LLMCache:
+    """
+    Exact-match cache of whole agent outputs, keyed by a SHA-256 of the request parts
+    (agent, profile, question, target job). Entries expire after `ttl` seconds, and the
+    least recently used entry is evicted beyond `maxsize`. Hit and miss counts are kept
+    for display.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60 * 60):
+        self._entries: "TTLCache[str, Any]" = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(*parts: Any) -> str:
+        """SHA-256 of the parts serialized as JSON with sorted keys, so equal dicts hash equally."""
+        payload = orjson.dumps(parts, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
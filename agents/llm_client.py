@@ -0,0 +1,55 @@
+import logging
+import threading
+from typing import Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+logger = logging.getLogger("llm_client")
+
+# Every ChatOpenAI/OpenAIEmbeddings instance would otherwise open its own connection
+# pool (and TLS handshakes) to api.openai.com. All models share these clients instead.
+# The async client must only be used from the background loop in async_runtime, since
+# httpx async connections are bound to the event loop that opened them.
+_HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=64, max_connections=128)
+
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+_clients_lock = threading.Lock()
+
+
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Returns the process-wide HTTP/2 keep-alive clients, creating them on first use."""
+    global _http_client, _http_async_client
+    if _http_client is None:
+        with _clients_lock:
+            if _http_client is None:
+                _http_async_client = httpx.AsyncClient(http2=True, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS)
+                _http_client = httpx.Client(http2=True, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS)
+                logger.info("Created shared OpenAI HTTP clients")
+    return _http_client, _http_async_client
+
+
+def build_chat_model(openai_api_key: str, model: str = "gpt-3.5-turbo", temperature: float = 0.2, **kwargs) -> ChatOpenAI:
+    """Creates a ChatOpenAI model that uses the shared HTTP clients."""
+    http_client, http_async_client = get_http_clients()
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        openai_api_key=openai_api_key,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        **kwargs
+    )
+
+
+def build_embeddings(openai_api_key: str, model: str = "text-embedding-3-small") -> OpenAIEmbeddings:
+    """Creates an OpenAIEmbeddings model that uses the shared HTTP clients."""
+    http_client, http_async_client = get_http_clients()
+    return OpenAIEmbeddings(
+        model=model,
+        openai_api_key=openai_api_key,
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
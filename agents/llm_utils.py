@@ -0,0 +1,256 @@
+import json
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+import tiktoken
+
+logger = logging.getLogger("llm_utils")
+
+_decoder = json.JSONDecoder()
+
+# Default size limits for the compact profile digest used in chat prompts
+DIGEST_ABOUT_CHARS = 400
+DIGEST_MAX_SKILLS = 20
+DIGEST_MAX_EXPERIENCES = 3
+DIGEST_MAX_EDUCATION = 2
+
+# Size limits for the full profile section of the analysis prompts
+PROMPT_MAX_EXPERIENCES = 8
+PROMPT_DESCRIPTION_CHARS = 280
+PROMPT_EXPERIENCE_BYTES = 4096
+PROMPT_MAX_SKILLS = 50
+
+# OpenAI JSON mode: the model is constrained to emit a single valid JSON object.
+# The prompt must still mention JSON for the API to accept it.
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Hard cap on the prompt context (profile digest + history + question) per chat turn
+MAX_CONTEXT_TOKENS = 1500
+
+# Prompts shorter than this are never prompt-cached by the provider, so warming them is wasted
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+def extract_json(text: str) -> Any:
+    """
+    Parse the first JSON object embedded in an LLM response (e.g. inside prose
+    or a ```json fence) with a single forward decode from its opening brace.
+
+    Raises json.JSONDecodeError if the text contains no decodable object.
+    """
+    start = text.find("{")
+    while start != -1:
+        try:
+            return _decoder.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            start = text.find("{", start + 1)
+    raise json.JSONDecodeError("No JSON object found", text, 0)
+
+
+def parse_json_response(text: str) -> Any:
+    """
+    Parse an LLM JSON response: a direct orjson parse for clean JSON-mode output,
+    falling back to `extract_json` for objects wrapped in code fences or prose.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return extract_json(text)
+
+
+def extract_content(response: Any) -> str:
+    """Return the text of a chat model response (`AIMessage.content`), tolerating other response shapes."""
+    try:
+        return response.content
+    except AttributeError:
+        message = getattr(response, "message", None)
+        if message is not None:
+            return message.content
+        return getattr(response, "text", None) or str(response)
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = (text or "").strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def _item_name(item: Any, *keys: str) -> str:
+    if isinstance(item, dict):
+        for key in keys:
+            if item.get(key):
+                return str(item[key])
+    return str(item)
+
+
+def build_profile_digest(profile: Dict[str, Any], about_chars: int = DIGEST_ABOUT_CHARS,
+                         description_chars: int = 0) -> str:
+    """
+    Build a compact, prompt-ready summary of a profile: truncated about section,
+    the most recent experiences, the top skills and education.
+
+    Experience descriptions are included (truncated) only when `description_chars` > 0.
+    """
+    experiences = []
+    for exp in (profile.get("experience") or [])[:DIGEST_MAX_EXPERIENCES]:
+        if isinstance(exp, dict):
+            entry = f"{exp.get('title', 'Unknown Position')} at {exp.get('company', 'Unknown Company')}"
+            if description_chars and exp.get("description"):
+                entry += f" ({_truncate(exp['description'], description_chars)})"
+            experiences.append(entry)
+        else:
+            experiences.append(_truncate(str(exp), description_chars or 100))
+
+    skills = profile.get("skills") or []
+    skill_names = [_item_name(skill, "name", "title") for skill in skills[:DIGEST_MAX_SKILLS]]
+    if len(skills) > DIGEST_MAX_SKILLS:
+        skill_names.append(f"(+{len(skills) - DIGEST_MAX_SKILLS} more)")
+
+    education = []
+    for edu in (profile.get("education") or [])[:DIGEST_MAX_EDUCATION]:
+        if isinstance(edu, dict):
+            degree, school = edu.get("degree", ""), edu.get("school", "")
+            if degree or school:
+                education.append(f"{degree} from {school}".strip())
+        else:
+            education.append(str(edu))
+
+    return "\n".join([
+        f"- Name: {profile.get('name') or 'User'}",
+        f"- About: {_truncate(profile.get('about', ''), about_chars) or 'Not provided'}",
+        f"- Experience: {'; '.join(experiences) or 'No experience data provided'}",
+        f"- Skills: {', '.join(skill_names) or 'Not specified'}",
+        f"- Education: {'; '.join(education) or 'No education data provided'}",
+    ])
+
+
+# Profile key holding the pre-rendered profile section of the analysis chat prompts
+PROMPT_BLOCK_KEY = "_prompt_block"
+
+
+def summarize_experience(experience: List[Any], max_items: int = PROMPT_MAX_EXPERIENCES,
+                         max_chars_per: int = PROMPT_DESCRIPTION_CHARS,
+                         max_bytes: int = PROMPT_EXPERIENCE_BYTES) -> List[Any]:
+    """
+    Reduce experience entries to title, company, dates and a truncated description,
+    keeping at most `max_items` entries and `max_bytes` of serialized JSON.
+    """
+    summary, size = [], 2
+    for exp in (experience or [])[:max_items]:
+        if isinstance(exp, dict):
+            item = {key: exp[key] for key in ("title", "company") if exp.get(key)}
+            dates = next((exp[key] for key in ("dates", "dateRange", "duration") if exp.get(key)), None)
+            if dates is None and (exp.get("startDate") or exp.get("endDate")):
+                dates = f"{exp.get('startDate') or '?'} - {exp.get('endDate') or 'Present'}"
+            if dates:
+                item["dates"] = dates
+            if exp.get("description"):
+                item["description"] = _truncate(str(exp["description"]), max_chars_per)
+        else:
+            item = _truncate(str(exp), max_chars_per)
+        size += len(json.dumps(item, ensure_ascii=False, default=str).encode("utf-8")) + 1
+        if size > max_bytes:
+            break
+        summary.append(item)
+
+    if len(summary) < len(experience or []):
+        logger.info(f"Truncated experience from {len(experience)} to {len(summary)} entries for the prompt")
+    return summary
+
+
+def build_prompt_block(profile: Dict[str, Any]) -> str:
+    """Render the profile (name, about, summarized experience, top skills) for the analysis chat prompts."""
+    skills = profile.get("skills") or []
+    return "\n".join([
+        f"- Name: {profile.get('name', 'User')}",
+        f"- About: {profile.get('about', '')}",
+        f"- Experience: {json.dumps(summarize_experience(profile.get('experience')), ensure_ascii=False, default=str)}",
+        f"- Skills: {json.dumps(skills[:PROMPT_MAX_SKILLS], ensure_ascii=False, default=str)}",
+    ])
+
+
+def profile_prompt_block(profile: Dict[str, Any]) -> str:
+    """Return the block precomputed at profile load, building it only if it is missing."""
+    return profile.get(PROMPT_BLOCK_KEY) or build_prompt_block(profile)
+
+
+class ProfileDigestCache:
+    """
+    Per-session cache of profile digests, so the digest is built once per session
+    and every turn sends byte-identical profile text.
+    """
+
+    def __init__(self, about_chars: int = DIGEST_ABOUT_CHARS, description_chars: int = 0, max_sessions: int = 256):
+        self.about_chars = about_chars
+        self.description_chars = description_chars
+        self.max_sessions = max_sessions
+        self._digests: "OrderedDict[tuple, str]" = OrderedDict()
+
+    def get(self, profile: Dict[str, Any], session_id: Optional[str]) -> str:
+        # Include the profile URL so loading a different profile in the same session rebuilds the digest
+        key = (session_id, profile.get("profileUrl") or profile.get("name"))
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = build_profile_digest(profile, self.about_chars, self.description_chars)
+            self._digests[key] = digest
+            if len(self._digests) > self.max_sessions:
+                self._digests.popitem(last=False)
+        return digest
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        return tiktoken.encoding_for_model("gpt-3.5-turbo")
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count gpt-3.5-turbo tokens, falling back to a ~4 chars/token estimate."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+EMPTY_CONVERSATION = "This is the beginning of our conversation."
+
+
+@lru_cache(maxsize=128)
+def _render_conversation_context(history: Tuple[Tuple[str, str], ...], assistant_label: str) -> str:
+    return " | ".join(f"{'User' if role == 'user' else assistant_label}: {content}" for role, content in history)
+
+
+def build_conversation_context(chat_history: Sequence[Dict[str, str]], assistant_label: str = "Assistant") -> str:
+    """
+    Render the (already windowed and truncated) session history as a one-line
+    conversation summary. The app normalizes messages on ingestion, so every entry
+    is a {"role", "content"} dict. Rendering is memoized on the message contents,
+    so the agents running within one turn share the work.
+    """
+    if not chat_history:
+        return EMPTY_CONVERSATION
+    return _render_conversation_context(tuple((m["role"], m["content"]) for m in chat_history), assistant_label)
+
+
+def trim_history_to_budget(chat_history: Sequence[Dict], fixed_text: str,
+                           max_tokens: int = MAX_CONTEXT_TOKENS) -> List[Dict]:
+    """
+    Keep the most recent messages of the (already windowed and truncated) session
+    history that fit in `max_tokens` alongside `fixed_text`; older messages are
+    dropped first.
+    """
+    budget = max_tokens - count_tokens(fixed_text)
+    kept = []
+    for msg in reversed(chat_history):
+        budget -= count_tokens(msg["content"])
+        if budget < 0:
+            break
+        kept.append(msg)
+    if len(kept) < len(chat_history):
+        logger.info(f"Dropped {len(chat_history) - len(kept)} history message(s) to stay within {max_tokens} tokens")
+    return kept[::-1]
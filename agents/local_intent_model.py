@@ -0,0 +1,49 @@
+import logging
+from typing import Optional, Tuple
+
+logger = logging.getLogger("local_intent_model")
+
+
+class LocalIntentModel:
+    """
+    Fine-tuned sequence-classification model for intents, served in-process.
+
+    The model directory must be a Hugging Face `AutoModelForSequenceClassification`
+    checkpoint whose `id2label` names are the agent names (e.g. "job_fit_agent").
+    Linear layers are dynamically quantized to int8 so inference stays fast on CPU.
+    """
+
+    def __init__(self, tokenizer, model, torch_module):
+        self.tokenizer = tokenizer
+        self.model = model
+        self._torch = torch_module
+
+    @classmethod
+    def load(cls, model_path: str) -> Optional["LocalIntentModel"]:
+        """Loads the model, or returns None if transformers/torch or the checkpoint are unavailable."""
+        try:
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        except ImportError:
+            logger.warning("transformers/torch not installed; using the OpenAI intent classifier")
+            return None
+
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
+            model = AutoModelForSequenceClassification.from_pretrained(model_path).eval()
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        except Exception as e:
+            logger.warning(f"Failed to load local intent model from {model_path}: {e}")
+            return None
+
+        logger.info(f"Loaded local intent model from {model_path}")
+        return cls(tokenizer, model, torch)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Returns the most likely intent and its softmax probability."""
+        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=128)
+        with self._torch.inference_mode():
+            logits = self.model(**inputs).logits[0]
+        probabilities = logits.softmax(dim=-1)
+        index = int(probabilities.argmax())
+        return self.model.config.id2label[index], float(probabilities[index])
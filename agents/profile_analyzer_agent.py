@@ -1,30 +1,47 @@
 import logging
-from typing import Dict, Any, List
-from langchain_openai import ChatOpenAI
+from typing import Dict, Any, List, Callable, Optional
 import json
+from agents.batched_llm import BatchedChatOpenAI
+from agents.llm_cache import SemanticCache
+from agents.llm_client import build_chat_model, build_embeddings
+from agents.llm_utils import JSON_RESPONSE_FORMAT, PROMPT_MAX_SKILLS, build_conversation_context, extract_content, parse_json_response, profile_prompt_block, summarize_experience
 
 logger = logging.getLogger("profile_analyzer_agent")
 
+# Static system prompts, kept byte-identical across calls (and always the first message)
+# so they form a cacheable prompt prefix.
+SYSTEM_PROMPT_PROFILE_ANALYZE = "You are a LinkedIn profile analysis expert."
+
+SYSTEM_PROMPT_PROFILE_CHAT = """You are an expert LinkedIn profile analyst. When users ask about their profile, provide detailed, actionable insights in a conversational tone. Use markdown formatting and be specific about their profile data. Consider the conversation history when providing analysis."""
+
 class ProfileAnalyzerAgent:
     """Production-grade, GPT-powered LinkedIn Profile Analyzer Agent."""
-    def __init__(self, openai_api_key: str):
-        # Use LangChain's ChatOpenAI for LLM calls, passing the API key
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0.2,
-            openai_api_key=openai_api_key
-        )
+    # Chat questions shorter than this are answered by the smaller, faster model
+    SMALL_MODEL_MAX_QUESTION_CHARS = 80
 
-    def analyze(self, profile: Dict[str, Any], session_id: str = None, user_question: str = None, chat_history: List[Dict] = None) -> Dict[str, Any]:
-        """Analyze LinkedIn profile and return strengths, weaknesses, and improvement suggestions."""
-        about = profile.get("about", "")
-        experience = profile.get("experience", [])
-        skills = profile.get("skills", [])
-        name = profile.get("name", "User")
-        
+    def __init__(self, openai_api_key: str, llm=None, small_llm=None, small_model: str = "gpt-4o-mini"):
+        # Calls are coalesced with other sessions' (and other agents') requests on the
+        # shared event loop; pass shared models to batch with other agents
+        self.llm = llm or BatchedChatOpenAI(build_chat_model(openai_api_key, temperature=0.2))
+        self.small_llm = small_llm or BatchedChatOpenAI(build_chat_model(openai_api_key, model=small_model, temperature=0.2))
+        self.cache = SemanticCache(build_embeddings(openai_api_key))
+
+    async def analyze(self, profile: Dict[str, Any], session_id: str = None, user_question: str = None, chat_history: List[Dict] = None,
+                      on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Analyze LinkedIn profile and return strengths, weaknesses, and improvement suggestions.
+
+        For chat interactions, `on_token` (if given) is called with each response
+        token as it streams in, so the UI can render before the full answer is ready.
+        """
         # If this is a chat interaction, provide a conversational response
         if user_question:
-            return self._handle_chat_analysis(profile, user_question, session_id, chat_history)
+            return await self._handle_chat_analysis(profile, user_question, session_id, chat_history, on_token)
+        
+        about = profile.get("about", "")
+        experience = json.dumps(summarize_experience(profile.get("experience")), ensure_ascii=False, default=str)
+        skills = (profile.get("skills") or [])[:PROMPT_MAX_SKILLS]
+        name = profile.get("name", "User")
         
         # Standard analysis
         prompt = (
@@ -34,15 +51,20 @@ class ProfileAnalyzerAgent:
             f"\nRespond in JSON with keys: strengths, weaknesses, suggestions."
         )
         try:
-            response = self.llm.invoke([
-                {"type": "system", "content": "You are a LinkedIn profile analysis expert."},
-                {"type": "human", "content": prompt}
-            ])
-            result = response.content.strip()
-            try:
-                analysis = json.loads(result)
-            except Exception:
-                analysis = {"raw": result}
+            # Repeat analyses of the same profile are served from the exact-match cache
+            cache_bucket = self.cache.fingerprint(SYSTEM_PROMPT_PROFILE_ANALYZE, prompt)
+            result, _ = await self.cache.aget(cache_bucket, "", semantic=False)
+            if result is None:
+                # JSON mode guarantees a parseable object
+                response = await self.llm.ainvoke([
+                    {"type": "system", "content": SYSTEM_PROMPT_PROFILE_ANALYZE},
+                    {"type": "human", "content": prompt}
+                ], response_format=JSON_RESPONSE_FORMAT)
+                
+                result = extract_content(response).strip()
+            
+            analysis = parse_json_response(result)
+            self.cache.put(cache_bucket, None, result, question="")
             logger.info(f"Profile analysis completed for session {session_id}")
             return analysis
         except Exception as e:
@@ -54,23 +76,17 @@ class ProfileAnalyzerAgent:
                 "suggestions": ["Unable to analyze profile due to an error"]
             }
 
-    def _handle_chat_analysis(self, profile: Dict[str, Any], user_question: str, session_id: str, chat_history: List[Dict] = None) -> Dict[str, Any]:
+    async def _handle_chat_analysis(self, profile: Dict[str, Any], user_question: str, session_id: str, chat_history: List[Dict] = None,
+                                 on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """Handle chat-based profile analysis requests."""
-        about = profile.get("about", "")
-        experience = profile.get("experience", [])
-        skills = profile.get("skills", [])
-        name = profile.get("name", "User")
+        # Rendered once at profile load, so every turn sends the same profile text
+        profile_block = profile_prompt_block(profile)
         
         # Build conversation context from chat history
         context = self._build_conversation_context(chat_history or [])
         
-        system_prompt = """You are an expert LinkedIn profile analyst. When users ask about their profile, provide detailed, actionable insights in a conversational tone. Use markdown formatting and be specific about their profile data. Consider the conversation history when providing analysis."""
-
         user_prompt = f"""**User Profile:**
-- Name: {name}
-- About: {about}
-- Experience: {experience}
-- Skills: {skills}
+{profile_block}
 
 **Conversation History:** {context}
 
@@ -79,12 +95,22 @@ class ProfileAnalyzerAgent:
 Please provide a detailed, helpful response that directly addresses their question about their profile. Be specific and actionable. Consider what was discussed previously in the conversation."""
 
         try:
-            response = self.llm.invoke([
-                {"type": "system", "content": system_prompt},
-                {"type": "human", "content": user_prompt}
-            ])
-            
-            content = response.content if hasattr(response, 'content') else str(response)
+            # Same or near-duplicate questions about the same profile, in the same
+            # conversation context, are answered from the cache
+            cache_bucket = self.cache.fingerprint(SYSTEM_PROMPT_PROFILE_CHAT, profile_block, context)
+            content, question_embedding = await self.cache.aget(cache_bucket, user_question)
+            if content is not None:
+                if on_token:
+                    on_token(content)
+            else:
+                # Stream the completion so the first tokens can be shown while the rest is generated
+                # Short, simple questions do not need the larger model
+                llm = self.small_llm if len(user_question) < self.SMALL_MODEL_MAX_QUESTION_CHARS else self.llm
+                content = await llm.astream_text([
+                    {"type": "system", "content": SYSTEM_PROMPT_PROFILE_CHAT},
+                    {"type": "human", "content": user_prompt}
+                ], on_token)
+                self.cache.put(cache_bucket, question_embedding, content, question=user_question)
             
             return {
                 "message": content.strip(),
@@ -106,25 +132,4 @@ Please provide a detailed, helpful response that directly addresses their questi
 
     def _build_conversation_context(self, chat_history: List[Dict]) -> str:
         """Build conversation context from chat history."""
-        if not chat_history:
-            return "This is the beginning of our conversation."
-        
-        # Take last 3 exchanges to avoid token limits
-        recent_messages = chat_history[-6:]  # 3 user + 3 assistant messages
-        context_parts = []
-        
-        for msg in recent_messages:
-            if isinstance(msg, dict):
-                role = msg.get("role", "unknown")
-                content = msg.get("content", "")[:150]  # Limit content length
-                
-                if role == "user":
-                    context_parts.append(f"User: {content}")
-                elif role == "assistant":
-                    context_parts.append(f"Assistant: {content}")
-            else:
-                # Fallback for other formats
-                content = str(msg)[:150]
-                context_parts.append(f"Message: {content}")
-        
-        return " | ".join(context_parts) if context_parts else "This is the beginning of our conversation." 
\ No newline at end of file
+        return build_conversation_context(chat_history) 
\ No newline at end of file
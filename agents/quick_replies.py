@@ -0,0 +1,87 @@
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("quick_replies")
+
+
+def _names(items: List[Any], *keys: str) -> List[str]:
+    names = []
+    for item in items or []:
+        if isinstance(item, dict):
+            name = next((str(item[key]) for key in keys if item.get(key)), "")
+        else:
+            name = str(item)
+        if name:
+            names.append(name)
+    return names
+
+
+def _current_role(profile: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    experience = profile.get("experience") or []
+    return experience[0] if experience and isinstance(experience[0], dict) else None
+
+
+def skills_reply(profile: Dict[str, Any], job_description: str) -> str:
+    skills = _names(profile.get("skills"), "name", "title")
+    if not skills:
+        return "I couldn't find any skills on your LinkedIn profile. Adding 10–15 relevant skills is one of the quickest wins for search visibility. 💡"
+    lines = "\n".join(f"- {skill}" for skill in skills)
+    return f"## 🛠️ Your Listed Skills ({len(skills)})\n\n{lines}"
+
+
+def experience_reply(profile: Dict[str, Any], job_description: str) -> str:
+    positions = [
+        f"- **{exp.get('title', 'Unknown Position')}** at {exp.get('company', 'Unknown Company')}"
+        + (f" ({exp['duration']})" if exp.get("duration") else "")
+        for exp in profile.get("experience") or [] if isinstance(exp, dict)
+    ]
+    if not positions:
+        return "I couldn't find any experience entries on your LinkedIn profile."
+    return "## 💼 Your Experience\n\n" + "\n".join(positions)
+
+
+def education_reply(profile: Dict[str, Any], job_description: str) -> str:
+    entries = []
+    for edu in profile.get("education") or []:
+        if isinstance(edu, dict):
+            degree, school = edu.get("degree", ""), edu.get("school", "")
+            if degree and school:
+                entries.append(f"- {degree} from {school}")
+            elif degree or school:
+                entries.append(f"- {degree or school}")
+        else:
+            entries.append(f"- {edu}")
+    if not entries:
+        return "I couldn't find any education entries on your LinkedIn profile."
+    return "## 🎓 Your Education\n\n" + "\n".join(entries)
+
+
+def current_role_reply(profile: Dict[str, Any], job_description: str) -> str:
+    role = _current_role(profile)
+    if role is None:
+        return "I couldn't find a current position on your LinkedIn profile."
+    return f"Your most recent position is **{role.get('title', 'Unknown Position')}** at **{role.get('company', 'Unknown Company')}**."
+
+
+# Whole-question patterns (lowercased, trailing punctuation stripped) that can be answered
+# straight from the profile. Only unambiguous lookups belong here; anything that rewrites or
+# judges content (e.g. headline suggestions) goes to the LLM.
+TEMPLATES: Dict[re.Pattern, Callable[[Dict[str, Any], str], str]] = {
+    re.compile(r"(?:what|which) (?:are|is) my (?:current |listed )?skills?"): skills_reply,
+    re.compile(r"(?:list|show)(?: me)? my skills"): skills_reply,
+    re.compile(r"(?:list|show|summari[sz]e)(?: me)? my (?:experience|work history)"): experience_reply,
+    re.compile(r"(?:what is|what's|show)(?: me)? my education"): education_reply,
+    re.compile(r"(?:what is|what's) my (?:current |latest )?(?:role|job|position|title)"): current_role_reply,
+}
+
+
+def quick_reply(user_question: str, profile: Dict[str, Any], job_description: str = "") -> Optional[str]:
+    """Return a templated answer for trivial questions, or None if the question needs the LLM."""
+    question = user_question.strip().lower().rstrip("?!. ")
+    for pattern, handler in TEMPLATES.items():
+        if pattern.fullmatch(question):
+            logger.info(f"Quick reply via {handler.__name__}")
+            return handler(profile, job_description)
+    logger.info(f"No quick reply for question: {question[:80]}")
+    return None
@@ -2,12 +2,20 @@ import streamlit as st
 import os
 from dotenv import load_dotenv
 from state import State
-from graph_utils import build_graph
+from graph_utils import NODE_CACHE, PARALLEL_ANSWER_SEPARATOR, build_graph, record_thread_activity
+from routing import AGENT_OUTPUT_KEYS
+from agents.llm_utils import PROMPT_BLOCK_KEY, build_prompt_block
 from scraper.linkedin_scraper import fetch_linkedin_profile
 import logging
-import json
+from logging.handlers import RotatingFileHandler
+import orjson
 import uuid
 import platform
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import async_runtime
 
 # --- Basic Setup ---
 load_dotenv()
@@ -27,8 +35,9 @@ os.makedirs(log_dir, exist_ok=True)
 
 # Configure logging for both local and deployment
 try:
+    # Rotate at 10 MB, keeping 5 old files, so the log cannot grow without bound
     logging.basicConfig(
-        filename="logs/app.log",
+        handlers=[RotatingFileHandler(os.path.join(log_dir, "app.log"), maxBytes=10_000_000, backupCount=5)],
         level=logging.INFO,
         format="%(asctime)s %(levelname)s %(name)s %(message)s"
     )
@@ -42,23 +51,87 @@ except Exception as e:
 
 logger = logging.getLogger("app")
 
+# Agents see only the last 3 exchanges, each message cut to 150 characters. The window is
+# maintained on insertion so building a prompt never copies or re-truncates the history.
+CONTEXT_WINDOW_MESSAGES = 6
+CONTEXT_MESSAGE_CHARS = 150
+
 # --- Helper Functions ---
-def normalize_chat_history(history):
+class LazyJSON:
+    """Log argument that serializes its value (truncated) only if the record is actually emitted."""
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=500):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        return orjson.dumps(self.value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()[:self.limit]
+
+def normalize_message(msg):
+    """
+    Converts a single message, regardless of its source (LangChain message object
+    or simple dict), to the consistent dictionary format used for display in the UI.
+    """
+    if isinstance(msg, dict):
+        return msg
+    if hasattr(msg, 'content'):
+        role = "user" if hasattr(msg, 'type') and msg.type == 'human' else "assistant"
+        return {"role": role, "content": msg.content}
+    return {"role": "assistant", "content": str(msg)}
+
+def remember_message(role, content):
+    """
+    Appends a message to the displayed chat history and to the bounded window of
+    recent messages that is sent to the agents as conversation context.
+    Messages are normalized once here, so the stored history is always plain dicts.
+    """
+    if not isinstance(content, str):
+        content = normalize_message(content)["content"]
+    st.session_state["chat_history"].append({"role": role, "content": content})
+    st.session_state["recent_history"].append({"role": role, "content": content[:CONTEXT_MESSAGE_CHARS]})
+
+@st.cache_resource
+def get_shared_graph():
+    """
+    Compiles the conversational graph once per process. The graph holds no
+    per-session data (everything arrives in the input state), so all sessions share it.
+    """
+    return build_graph()
+
+@st.cache_resource
+def get_scrape_executor():
+    """Worker threads for profile scraping, shared across sessions and reruns."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="profile-scrape")
+
+def stream_graph(graph, state, result_holder):
     """
-    Ensures that all messages in the chat history, regardless of their source
-    (LangChain message objects or simple dicts), are converted to a consistent 
-    dictionary format for reliable display in the UI.
+    Runs the graph in streaming mode on the shared background event loop, yielding
+    the response tokens that agents write to the "custom" stream. The final graph
+    state is stored in `result_holder["state"]` once the run completes.
     """
-    normalized = []
-    for msg in history:
-        if isinstance(msg, dict):
-            normalized.append(msg)
-        elif hasattr(msg, 'content'):
-            role = "user" if hasattr(msg, 'type') and msg.type == 'human' else "assistant"
-            normalized.append({"role": role, "content": msg.content})
+    events = queue.Queue()
+
+    # The session id is the checkpoint thread, so each session resumes its own saved state
+    config = {"configurable": {"thread_id": state["session_id"]}}
+
+    async def pump():
+        try:
+            await record_thread_activity(state["session_id"])
+            async for event in graph.astream(state, config, stream_mode=["custom", "values"]):
+                events.put(event)
+        finally:
+            events.put(None)
+
+    run = async_runtime.submit(pump())
+    while (event := events.get()) is not None:
+        mode, payload = event
+        if mode == "custom":
+            yield payload
         else:
-            normalized.append({"role": "assistant", "content": str(msg)})
-    return normalized
+            result_holder["state"] = payload
+    # Re-raise any error from the graph run in the Streamlit thread
+    run.result()
 
 # --- Main App UI ---
 st.title("🤖 LinkedIn Career Coach (AI-powered Chat)")
@@ -69,11 +142,16 @@ st.title("🤖 LinkedIn Career Coach (AI-powered Chat)")
 if "session_id" not in st.session_state:
     st.session_state["session_id"] = str(uuid.uuid4())
 if "chat_history" not in st.session_state:
+    # Always a list of {"role", "content"} dicts; see remember_message
     st.session_state["chat_history"] = []
+if "recent_history" not in st.session_state:
+    st.session_state["recent_history"] = deque(
+        ({"role": m["role"], "content": str(m["content"])[:CONTEXT_MESSAGE_CHARS]}
+         for m in st.session_state["chat_history"]),
+        maxlen=CONTEXT_WINDOW_MESSAGES
+    )
 if "profile_loaded" not in st.session_state:
     st.session_state["profile_loaded"] = False
-if "graph" not in st.session_state:
-    st.session_state["graph"] = None
 if "processing_prompt" not in st.session_state:
     # This key is crucial for the two-step chat processing logic.
     # It holds the user's message while the AI is "thinking".
@@ -106,30 +184,37 @@ with st.sidebar:
             
             with st.spinner("Scraping your LinkedIn profile... This may take a moment."):
                 try:
-                    # STAGE 1, STEP 1: Scrape profile data OUTSIDE the graph.
-                    profile_data = fetch_linkedin_profile(profile_url)
+                    # STAGE 1, STEP 1: Scrape profile data OUTSIDE the graph, in a worker
+                    # thread so the page can keep showing progress while the actor runs.
+                    scrape = get_scrape_executor().submit(fetch_linkedin_profile, profile_url)
+                    # Compile the shared conversational graph (agents, checkpointer) while the
+                    # actor runs, so the first chat turn does not wait for it after the scrape.
+                    get_shared_graph()
+                    progress = st.empty()
+                    started = time.monotonic()
+                    while not scrape.done():
+                        progress.caption(f"⏳ Still scraping... {int(time.monotonic() - started)}s elapsed")
+                        time.sleep(0.5)
+                    progress.empty()
+                    profile_data = scrape.result()
                     if not profile_data or not profile_data.get("name"):
                          st.error("❌ Could not scrape the profile. Please check the URL and ensure the profile is public.")
                          st.stop()
                     
-                    # STAGE 1, STEP 2: Store the loaded data in the session.
+                    # STAGE 1, STEP 2: Store the loaded data in the session, with the profile
+                    # section of the agents' prompts rendered once instead of on every turn.
+                    profile_data[PROMPT_BLOCK_KEY] = build_prompt_block(profile_data)
                     st.session_state["profile"] = profile_data
                     st.session_state["profile_loaded"] = True
                     
-                    # STAGE 1, STEP 3: Build the conversational graph for the session.
-                    st.session_state["graph"] = build_graph()
-                    
-                    # STAGE 1, STEP 4: Add a personalized welcome message to the chat.
+                    # STAGE 1, STEP 3: Add a personalized welcome message to the chat.
                     welcome_msg = f"""👋 **Welcome, {profile_data.get('name', 'User')}!**
 
 I've successfully loaded your LinkedIn profile. I'm ready to help you optimize your career path for the **{job_desc}** role.
 
 Ask me anything about your profile, job fit, or career!"""
 
-                    st.session_state["chat_history"].append({
-                        "role": "assistant",
-                        "content": welcome_msg
-                    })
+                    remember_message("assistant", welcome_msg)
                     
                     st.success("✅ Profile loaded successfully! Start chatting below.")
                     # Rerun to immediately reflect the new state (e.g., show the main chat interface).
@@ -141,12 +226,20 @@ Ask me anything about your profile, job fit, or career!"""
         else:
             st.warning("⚠️ Please enter both LinkedIn URL and job description.")
 
+    # Process-wide agent output cache, shared by all sessions
+    with st.expander("📊 Cache stats"):
+        cache_stats = NODE_CACHE.stats()
+        hits_col, misses_col = st.columns(2)
+        hits_col.metric("Hits", cache_stats["hits"])
+        misses_col.metric("Misses", cache_stats["misses"])
+        st.caption(f"Hit rate {cache_stats['hit_rate']:.0%} · {cache_stats['entries']} cached answers")
+
 # Main chat interface
 if st.session_state.get("profile_loaded"):
     st.subheader("💬 Chat with Your AI Career Coach")
     
     # Display chat history
-    for message in normalize_chat_history(st.session_state.chat_history):
+    for message in st.session_state.chat_history:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
     
@@ -154,7 +247,7 @@ if st.session_state.get("profile_loaded"):
     # The `st.chat_input` widget returns the user's message or None.
     if prompt := st.chat_input("Ask me anything about your career, profile, or job search..."):
         # Add the new user message to the history.
-        st.session_state.chat_history.append({"role": "user", "content": prompt})
+        remember_message("user", prompt)
         # Set the prompt as the one to be processed in the next rerun.
         st.session_state.processing_prompt = prompt
         # Rerun the script to immediately display the user's new message.
@@ -168,33 +261,41 @@ if st.session_state.get("profile_loaded"):
         with st.chat_message("assistant"):
             with st.spinner("🤔 Thinking..."):
                 try:
-                    if st.session_state["graph"] is None:
-                        st.session_state["graph"] = build_graph()
-                    
                     # Prepare the state to be sent to the graph.
                     # This includes the session-specific data and the current turn's data.
                     chat_state = {
                         "command": "chat",
                         "user_question": prompt_to_process,
                         "session_id": st.session_state["session_id"],
-                        "chat_history": normalize_chat_history(st.session_state["chat_history"]),
+                        "chat_history": st.session_state["recent_history"],
+                        # Clear any error and agent outputs checkpointed by a previous turn, so a
+                        # repeated question is answered afresh instead of matching a stale output
+                        "error": None,
+                        "analysis": None,
+                        "job_fit": None,
+                        "enhanced_content": None,
+                        "coaching": None,
                         "job_description": st.session_state.get("job_desc", ""),
                         "profile": st.session_state.get("profile", {})
                     }
                                         
-                    logger.info(f"Chat state prepared for session {st.session_state['session_id']}: {json.dumps(chat_state, default=str)[:500]}")
+                    logger.info("Chat state prepared for session %s: %s", st.session_state["session_id"], LazyJSON(chat_state))
                     
                     # Invoke the conversational graph.
                     logger.info(f"About to invoke graph with state keys: {list(chat_state.keys())}")
                     logger.info(f"User question: {prompt_to_process}")
                     logger.info(f"Session ID: {st.session_state['session_id']}")
                     
-                    result = st.session_state["graph"].invoke(chat_state)
+                    # Stream the graph run so token-streaming agents render as soon as
+                    # the first token arrives instead of after the full completion.
+                    result_holder = {}
+                    streamed = st.write_stream(stream_graph(get_shared_graph(), chat_state, result_holder))
+                    result = result_holder.get("state", {})
                     logger.info(f"Graph invocation completed. Result type: {type(result)}")
                     logger.info(f"Result keys: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
                     
                     # STAGE 2, STEP 3: Extract the response.
-                    if "error" in result:
+                    if result.get("error"):
                         response = f"❌ I encountered an error: {result['error']}"
                     else:
                         # Debug logging to see what we're getting from the graph
@@ -203,36 +304,42 @@ if st.session_state.get("profile_loaded"):
                         
                         # This logic intelligently extracts the response from the correct agent's output,
                         # based on the intent classification from the current turn.
-                        response = None
-                        intent = result.get("intent_classification", {}).get("intent")
-                        agent_output_map = {
-                            "profile_analyzer_agent": "analysis", "job_fit_agent": "job_fit",
-                            "content_enhancer_agent": "enhanced_content", "career_coach_agent": "coaching"
-                        }
-                        output_key = agent_output_map.get(intent)
-                        
-                        logger.info(f"Intent: {intent}, Output key: {output_key}")
-
-                        if output_key and output_key in result:
-                            agent_output = result.get(output_key, {})
-                            logger.info(f"Agent output: {agent_output}")
-                            # Ensure the response is for the *current* question to avoid showing stale data.
-                            if agent_output.get("user_question") == prompt_to_process:
-                                response = agent_output.get("message") or agent_output.get("answer")
+                        classification = result.get("intent_classification", {})
+                        intent = classification.get("intent")
+                        # Compound questions are answered by several agents; their answers are shown in intent order
+                        intents = classification.get("intents") or [intent]
+                        answers = []
+                        for turn_intent in intents:
+                            output_key = AGENT_OUTPUT_KEYS.get(turn_intent)
+                            logger.info(f"Intent: {turn_intent}, Output key: {output_key}")
+                            if output_key and output_key in result:
+                                agent_output = result.get(output_key, {})
+                                logger.info(f"Agent output: {agent_output}")
+                                # Ensure the response is for the *current* question to avoid showing stale data.
+                                if agent_output.get("user_question") == prompt_to_process:
+                                    answer = agent_output.get("message") or agent_output.get("answer")
+                                    if answer:
+                                        answers.append(answer)
+                        response = PARALLEL_ANSWER_SEPARATOR.join(answers) or None
                         
                         # Fallback in case the primary extraction fails.
                         if not response: 
-                            # Try to get response from any available agent output
-                            for key in ["coaching", "analysis", "job_fit", "enhanced_content"]:
+                            # Try to get response from any available agent output. Checkpointed state
+                            # keeps earlier turns' outputs, so only accept one for the current question.
+                            for key in AGENT_OUTPUT_KEYS.values():
                                 if key in result:
                                     agent_output = result.get(key, {})
-                                    if isinstance(agent_output, dict):
+                                    if isinstance(agent_output, dict) and agent_output.get("user_question") == prompt_to_process:
                                         potential_response = agent_output.get("message") or agent_output.get("answer")
                                         if potential_response:
                                             response = potential_response
                                             logger.info(f"Using fallback response from {key}")
                                             break
                             
+                            if not response and isinstance(streamed, str) and streamed.strip():
+                                response = streamed.strip()
+                                logger.info("Using streamed response text")
+
                             if not response:
                                 response = "I understand. Let me provide some insights."
                                 logger.warning("No response found in any agent output")
@@ -241,12 +348,12 @@ if st.session_state.get("profile_loaded"):
                         logger.info(f"Final response: {response[:100]}...")
                         
                     # Add the final AI response to the chat history.
-                    st.session_state["chat_history"].append({"role": "assistant", "content": response})
+                    remember_message("assistant", response)
                     logger.info(f"Chat history length after adding response: {len(st.session_state['chat_history'])}")
                     
                 except Exception as e:
                     error_msg = f"❌ Sorry, I encountered an error: {str(e)}"
-                    st.session_state["chat_history"].append({"role": "assistant", "content": error_msg})
+                    remember_message("assistant", error_msg)
                     logger.error(f"Chat error for session {st.session_state['session_id']}: {e}")
                 finally:
                     # STAGE 2, STEP 4: Clear the processed prompt and rerun.
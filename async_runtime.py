@@ -0,0 +1,51 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Awaitable, Optional
+
+logger = logging.getLogger("async_runtime")
+
+# Streamlit runs every session on its own short-lived thread, so work that must
+# outlive a single rerun (request batching, shared async clients) runs on one
+# long-lived event loop in a daemon thread instead.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the process-wide background event loop, starting it on first use."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True).start()
+                logger.info("Started background event loop")
+                _loop = loop
+    return _loop
+
+
+def in_background_loop() -> bool:
+    """True when called from a coroutine already running on the background loop."""
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+def submit(coro: Awaitable[Any]) -> concurrent.futures.Future:
+    """Schedules a coroutine on the background loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """Runs a coroutine on the background loop and blocks the calling thread for its result."""
+    return submit(coro).result(timeout)
+
+
+async def run_async(coro: Awaitable[Any]) -> Any:
+    """Awaits a coroutine on the background loop from any other event loop."""
+    if in_background_loop():
+        return await coro
+    return await asyncio.wrap_future(submit(coro))
@@ -1,13 +1,26 @@
+import asyncio
 import logging
+import inspect
+import threading
+import time
+from functools import lru_cache
+import aiosqlite
 from langgraph.graph import StateGraph
-from langgraph.checkpoint.memory import MemorySaver
-from state import State, memory_saver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.types import StreamWriter
+from state import State
 from agents.profile_analyzer_agent import ProfileAnalyzerAgent
 from agents.job_fit_agent import JobFitAgent
 from agents.content_enhancer_agent import ContentEnhancerAgent
 from agents.career_coach_agent import CareerCoachAgent
 from agents.intent_classifier_agent import IntentClassifierAgent
-from routing import router
+from agents.agent_pool import AgentPool
+from agents.batched_llm import BatchedChatOpenAI
+from agents.llm_cache import LLMCache
+from agents.llm_client import build_chat_model
+from agents.quick_replies import quick_reply
+from routing import AGENT_OUTPUT_KEYS, has_answered, router
+import async_runtime
 import os
 from dotenv import load_dotenv
 import streamlit as st
@@ -17,18 +30,70 @@ logger = logging.getLogger("graph")
 load_dotenv()
 
 # --- Agent Initialization ---
-# We'll initialize agents inside the build_graph function to avoid st.secrets issues during import
-profile_agent = None
-job_fit_agent = None
-content_enhancer_agent = None
-career_coach_agent = None
-intent_classifier_agent = None
-
-
-def _initialize_agents():
-    """Initialize agents with proper API key handling."""
-    global profile_agent, job_fit_agent, content_enhancer_agent, career_coach_agent, intent_classifier_agent
-    
+# Agents are built when the graph is built rather than at import (to avoid st.secrets
+# issues during import) and shared by every session through the pool.
+AGENT_POOL = AgentPool()
+
+
+# Streamed between the answers of consecutive agents on a multi-intent turn
+PARALLEL_ANSWER_SEPARATOR = "\n\n---\n\n"
+
+
+class _DeferredWriter:
+    """
+    Stream writer handed to a speculatively started agent. Tokens are buffered
+    until the speculation is confirmed, then flushed to the real writer; if the
+    classifier picks a different agent the buffer is simply discarded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._target = None
+
+    def __call__(self, chunk):
+        with self._lock:
+            if self._target is None:
+                self._buffer.append(chunk)
+                return
+        self._target(chunk)
+
+    def release(self, target):
+        with self._lock:
+            for chunk in self._buffer:
+                target(chunk)
+            self._buffer = []
+            self._target = target
+
+
+class _SequentialWriter:
+    """
+    Forwards the streams of several agents, one agent after another, to a single
+    writer, with a separator between the answers of consecutive agents.
+    """
+
+    def __init__(self, target, started=False):
+        self._target = target
+        self._started = started
+
+    def next_agent(self):
+        """Returns the writer for the next agent; the separator precedes its first chunk."""
+        first = True
+
+        def write(chunk):
+            nonlocal first
+            if first:
+                if self._started:
+                    self._target(PARALLEL_ANSWER_SEPARATOR)
+                first, self._started = False, True
+            self._target(chunk)
+
+        return write
+
+
+@lru_cache(maxsize=1)
+def _get_key() -> str:
+    """Reads the OpenAI API key once per process."""
     # Try Streamlit secrets first (deployment)
     OPENAI_API_KEY = None
     try:
@@ -39,12 +104,118 @@ def _initialize_agents():
         
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY not found in secrets or environment variables")
+    return OPENAI_API_KEY
+
+
+@lru_cache(maxsize=1)
+def _analysis_llms():
+    """
+    The analysis agents share one model (plus the small model for short questions),
+    and with it the process-wide HTTP/2 connection pool, so a session never pays an
+    extra TCP/TLS handshake for them.
+    """
+    return (
+        BatchedChatOpenAI(build_chat_model(_get_key(), temperature=0.2)),
+        BatchedChatOpenAI(build_chat_model(_get_key(), model="gpt-4o-mini", temperature=0.2)),
+    )
+
+
+@lru_cache(maxsize=1)
+def _longform_llm():
+    """
+    The coach and enhancer share one model (same settings), so they share its
+    HTTP/2 connection pool and batch queue instead of each opening their own.
+    Their long-form outputs can be served by a self-hosted OpenAI-compatible
+    endpoint (e.g. vLLM with a speculative draft model) via LONGFORM_LLM_*.
+    """
+    longform_options = {}
+    base_url = os.getenv("LONGFORM_LLM_BASE_URL")
+    if base_url:
+        longform_options["base_url"] = base_url
+        # Never send the OpenAI key to another host; vLLM accepts any key unless started with --api-key
+        api_key = os.getenv("LONGFORM_LLM_API_KEY") or "EMPTY"
+    else:
+        api_key = os.getenv("LONGFORM_LLM_API_KEY") or _get_key()
+    return BatchedChatOpenAI(build_chat_model(
+        api_key,
+        model=os.getenv("LONGFORM_LLM_MODEL", "gpt-3.5-turbo"),
+        temperature=0.2,
+        **longform_options
+    ))
+
+
+AGENT_FACTORIES = {
+    "profile_analyzer_agent": lambda: ProfileAnalyzerAgent(_get_key(), llm=_analysis_llms()[0], small_llm=_analysis_llms()[1]),
+    "job_fit_agent": lambda: JobFitAgent(_get_key(), llm=_analysis_llms()[0], small_llm=_analysis_llms()[1]),
+    "content_enhancer_agent": lambda: ContentEnhancerAgent(_get_key(), llm=_longform_llm()),
+    "career_coach_agent": lambda: CareerCoachAgent(_get_key(), llm=_longform_llm()),
+    "intent_classifier_agent": lambda: IntentClassifierAgent(_get_key()),
+}
+
+
+def get_agent(name: str):
+    """Returns the shared instance of the named agent, building it on first use."""
+    return AGENT_POOL.get(name, AGENT_FACTORIES[name])
+
+
+# --- Checkpointing ---
+# Graph state is checkpointed to SQLite per session (thread_id). Threads that have been
+# idle for CHECKPOINT_TTL_SECONDS are deleted by a periodic sweep to bound disk growth.
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", os.path.join(os.path.dirname(__file__), "checkpoints.db"))
+CHECKPOINT_TTL_SECONDS = 24 * 60 * 60
+CHECKPOINT_SWEEP_INTERVAL_SECONDS = 60 * 60
+
+_checkpoint_conn = None
+
+
+async def _open_checkpointer() -> AsyncSqliteSaver:
+    """Runs on the background loop, which owns the SQLite connection for the process."""
+    global _checkpoint_conn
+    _checkpoint_conn = await aiosqlite.connect(CHECKPOINT_DB_PATH)
+    # WAL lets readers proceed while a checkpoint is being written; with WAL,
+    # synchronous=NORMAL is still crash-safe and avoids an fsync per commit
+    await _checkpoint_conn.execute("PRAGMA journal_mode=WAL")
+    await _checkpoint_conn.execute("PRAGMA synchronous=NORMAL")
+    await _checkpoint_conn.execute(
+        "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)"
+    )
+    await _checkpoint_conn.commit()
+    saver = AsyncSqliteSaver(_checkpoint_conn)
+    await saver.setup()
+    asyncio.get_running_loop().create_task(_sweep_checkpoints())
+    logger.info(f"Checkpointing graph state to {CHECKPOINT_DB_PATH}")
+    return saver
 
-    profile_agent = ProfileAnalyzerAgent(OPENAI_API_KEY)
-    job_fit_agent = JobFitAgent(OPENAI_API_KEY)
-    content_enhancer_agent = ContentEnhancerAgent(OPENAI_API_KEY)
-    career_coach_agent = CareerCoachAgent(OPENAI_API_KEY)
-    intent_classifier_agent = IntentClassifierAgent(OPENAI_API_KEY)
+
+async def record_thread_activity(thread_id: str) -> None:
+    """Marks a session as active so its checkpoints are kept for another TTL period."""
+    if _checkpoint_conn is None:
+        return
+    await _checkpoint_conn.execute(
+        "INSERT INTO thread_activity (thread_id, last_seen) VALUES (?, ?) "
+        "ON CONFLICT(thread_id) DO UPDATE SET last_seen = excluded.last_seen",
+        (thread_id, time.time())
+    )
+    await _checkpoint_conn.commit()
+
+
+async def _sweep_checkpoints() -> None:
+    """Deletes the checkpoints of sessions idle for longer than CHECKPOINT_TTL_SECONDS."""
+    while True:
+        try:
+            cutoff = time.time() - CHECKPOINT_TTL_SECONDS
+            for table in ("checkpoints", "writes"):
+                await _checkpoint_conn.execute(
+                    f"DELETE FROM {table} WHERE thread_id IN (SELECT thread_id FROM thread_activity WHERE last_seen < ?)",
+                    (cutoff,)
+                )
+            cursor = await _checkpoint_conn.execute("DELETE FROM thread_activity WHERE last_seen < ?", (cutoff,))
+            await _checkpoint_conn.commit()
+            if cursor.rowcount:
+                logger.info(f"Deleted checkpoints of {cursor.rowcount} expired session(s)")
+        except Exception as e:
+            logger.error(f"Checkpoint sweep failed: {e}")
+        await asyncio.sleep(CHECKPOINT_SWEEP_INTERVAL_SECONDS)
 
 
 # --- Agent Node Definitions ---
@@ -52,105 +223,222 @@ def _initialize_agents():
 # It takes the current state, performs an action, and returns a dictionary of
 # results to be merged back into the state.
 
-def profile_analyzer_node(state: State) -> State:
-    """Invokes the Profile Analyzer agent and returns its analysis."""
-    global profile_agent
-    if profile_agent is None:
-        _initialize_agents()
-        
-    profile = state.get("profile", {})
-    session_id = state.get("session_id", "")
-    user_question = state.get("user_question", "")
-    chat_history = state.get("chat_history", [])
-    try:
-        result = profile_agent.analyze(profile, session_id, user_question, chat_history)
-        return {"analysis": result}
-    except Exception as e:
-        logger.error(f"Profile analyzer error for session {session_id}: {e}")
-        return {"error": str(e)}
+def make_agent_node(agent_name: str, method_name: str, needs_job_desc: bool = False, streams: bool = True):
+    """
+    Builds the node for an agent: it calls `method_name` on the pooled agent with the
+    turn's profile, question and history (plus the target job if `needs_job_desc`) and
+    returns the result under the agent's output key. Agents that `stream` get the
+    graph's writer as `on_token`, so response tokens reach the "custom" stream as they arrive.
+    """
+    output_key = AGENT_OUTPUT_KEYS[agent_name]
 
+    async def agent_node(state: State, writer: StreamWriter) -> State:
+        session_id = state.get("session_id", "")
+        kwargs = {
+            "profile": state.get("profile", {}),
+            "session_id": session_id,
+            "user_question": state.get("user_question", ""),
+            "chat_history": state.get("chat_history", []),
+        }
+        if needs_job_desc:
+            kwargs["job_description"] = state.get("job_description", "")
+        if streams:
+            kwargs["on_token"] = writer
+        try:
+            result = await getattr(get_agent(agent_name), method_name)(**kwargs)
+            return {output_key: result}
+        except Exception as e:
+            logger.error(f"{agent_name} error for session {session_id}: {e}")
+            return {"error": str(e)}
 
-def job_fit_node(state: State) -> State:
-    """Invokes the Job Fit agent and returns its analysis."""
-    global job_fit_agent
-    if job_fit_agent is None:
-        _initialize_agents()
-        
-    profile = state.get("profile", {})
-    job_desc = state.get("job_description", "")
-    session_id = state.get("session_id", "")
-    user_question = state.get("user_question", "")
-    chat_history = state.get("chat_history", [])
-    try:
-        result = job_fit_agent.analyze(profile, job_desc, session_id, user_question, chat_history)
-        return {"job_fit": result}
-    except Exception as e:
-        logger.error(f"Job fit error for session {session_id}: {e}")
-        return {"error": str(e)}
+    agent_node.__name__ = f"{agent_name}_node"
+    return agent_node
 
 
-def content_enhancer_node(state: State) -> State:
-    """Invokes the Content Enhancer agent and returns its suggestions."""
-    global content_enhancer_agent
-    if content_enhancer_agent is None:
-        _initialize_agents()
-        
-    profile = state.get("profile", {})
-    session_id = state.get("session_id", "")
-    user_question = state.get("user_question", "")
-    chat_history = state.get("chat_history", [])
-    try:
-        result = content_enhancer_agent.enhance(profile, session_id, user_question, chat_history)
-        return {"enhanced_content": result}
-    except Exception as e:
-        logger.error(f"Content enhancer error for session {session_id}: {e}")
-        return {"error": str(e)}
+# Process-wide cache of agent outputs, shared by all sessions (stats are shown in the sidebar)
+NODE_CACHE = LLMCache(maxsize=1024, ttl=60 * 60)
 
 
-def career_coach_node(state: State) -> State:
-    """Invokes the Career Coach agent and returns its advice."""
-    global career_coach_agent
-    if career_coach_agent is None:
-        _initialize_agents()
-        
-    profile = state.get("profile", {})
-    job_desc = state.get("job_description", "")
-    session_id = state.get("session_id", "")
-    user_question = state.get("user_question", "")
-    chat_history = state.get("chat_history", [])
-    try:
-        result = career_coach_agent.coach(
-            profile=profile,
-            job_description=job_desc,
-            session_id=session_id,
-            user_question=user_question,
-            chat_history=chat_history
+def cached_agent_node(output_key: str, node):
+    """
+    Wraps an agent node with NODE_CACHE. A question repeated for the same agent,
+    profile, target job and conversation context returns the stored output without
+    calling the agent; the cached answer is written to the stream in one chunk so it
+    still renders live. Failed outputs are never cached.
+    """
+    accepts_writer = "writer" in inspect.signature(node).parameters
+
+    async def cached_node(state: State, writer: StreamWriter) -> State:
+        key = NODE_CACHE.cache_key(
+            output_key, state.get("profile") or {}, state.get("user_question") or "", state.get("job_description") or "",
+            # Follow-ups ("elaborate on point 2") depend on the conversation, so it is part of the key
+            list(state.get("chat_history") or [])
         )
-        return {"coaching": result}
-    except Exception as e:
-        logger.error(f"Career coach error for session {session_id}: {e}")
-        return {"error": str(e)}
+        cached = NODE_CACHE.get(key)
+        if cached is not None:
+            logger.info(f"Node cache hit for {output_key} in session {state.get('session_id', '')}")
+            message = cached.get("message") or cached.get("answer")
+            if isinstance(message, str):
+                writer(message)
+            return {output_key: cached}
+
+        result = await (node(state, writer) if accepts_writer else node(state))
+        # Agents catch their own failures and report them inside the output
+        output = result.get(output_key)
+        if output and not result.get("error") and output.get("success", True) and "error" not in output:
+            NODE_CACHE.set(key, output)
+        return result
+
+    cached_node.__name__ = node.__name__
+    return cached_node
+
+
+# Maps each intent to the (cached) node that handles it, used for the graph itself,
+# speculative execution and parallel fan-out.
+AGENT_NODES = {
+    intent: cached_agent_node(AGENT_OUTPUT_KEYS[intent], node)
+    for intent, node in {
+        "profile_analyzer_agent": make_agent_node("profile_analyzer_agent", "analyze"),
+        "job_fit_agent": make_agent_node("job_fit_agent", "analyze", needs_job_desc=True),
+        "content_enhancer_agent": make_agent_node("content_enhancer_agent", "enhance", streams=False),
+        "career_coach_agent": make_agent_node("career_coach_agent", "coach", needs_job_desc=True),
+    }.items()
+}
 
 
-def intent_classifier_node(state: State) -> State:
+async def _run_agent_node(node, state: State, writer: StreamWriter) -> State:
+    """
+    Calls an agent node, passing the stream writer only to nodes that accept one.
+    Synchronous nodes run in a worker thread so they do not block the event loop.
+    """
+    args = (state, writer) if "writer" in inspect.signature(node).parameters else (state,)
+    if inspect.iscoroutinefunction(node):
+        return await node(*args)
+    return await asyncio.to_thread(node, *args)
+
+
+async def run_all_parallel(state: State, writer: StreamWriter) -> State:
+    """
+    Runs every agent a compound question asks for concurrently and merges their
+    outputs, so the turn costs the slowest agent's latency rather than the sum.
+
+    Agents that already answered this turn (a confirmed speculation) are skipped.
+    Each agent streams into its own buffer, and the buffers are released to the
+    real writer in intent order so the answers never interleave. Failed agents are
+    dropped from `intents`; the turn only errors if every agent failed.
+    """
+    classification = state.get("intent_classification") or {}
+    session_id = state.get("session_id", "")
+    intents = classification.get("intents") or []
+    answered = [intent for intent in intents if has_answered(state, intent)]
+    pending = [intent for intent in intents if intent not in answered]
+    if not pending:
+        # Nothing left to run (e.g. every agent was answered by the speculation)
+        return {}
+    logger.info(f"Running {pending} in parallel for session {session_id}")
+
+    writers = {intent: _DeferredWriter() for intent in pending}
+    # All agents start now; awaiting them in order only sequences their output
+    tasks = [asyncio.create_task(_run_agent_node(AGENT_NODES[intent], state, writers[intent])) for intent in pending]
+    answer_writer = _SequentialWriter(writer, started=bool(answered))
+    results = []
+    for intent, task in zip(pending, tasks):
+        writers[intent].release(answer_writer.next_agent())
+        results.append(await task)
+
+    merged, succeeded, errors = {}, list(answered), []
+    for intent, output in zip(pending, results):
+        if output.get("error"):
+            logger.error(f"{intent} failed on a parallel turn for session {session_id}: {output['error']}")
+            errors.append(output["error"])
+        else:
+            merged.update(output)
+            succeeded.append(intent)
+
+    if not succeeded:
+        return {"error": errors[0]}
+    return {**merged, "intent_classification": {**classification, "intents": [i for i in intents if i in succeeded]}}
+
+
+async def intent_classifier_node(state: State, writer: StreamWriter) -> State:
     """
     Invokes the Intent Classifier agent to determine which agent should handle
     the user's request. This is the entry point of our conversational graph.
+
+    While the classifier runs, the agent picked by a cheap keyword guess is
+    started speculatively. If the classifier agrees, that agent's output is
+    returned together with the classification and the turn finishes without a
+    second hop; otherwise the speculative result is discarded and the chosen
+    agent runs next, with its prompt prefix already warmed.
     """
-    global intent_classifier_agent
-    if intent_classifier_agent is None:
-        _initialize_agents()
-        
+    intent_classifier_agent = get_agent("intent_classifier_agent")
     user_question = state.get("user_question", "")
     session_id = state.get("session_id", "")
+
+    # Trivial questions answerable straight from the profile skip classification and the
+    # LLM entirely. Checked here, before routing, so every phrasing a template covers is
+    # served whichever agent its keywords would pick.
+    templated = quick_reply(user_question, state.get("profile", {}), state.get("job_description", ""))
+    if templated is not None:
+        writer(templated)
+        return {
+            "intent_classification": {
+                "intent": "career_coach_agent",
+                "intents": ["career_coach_agent"],
+                "confidence": 1.0,
+                "reasoning": "Answered from a profile template",
+                "session_id": session_id,
+                "success": True
+            },
+            "coaching": {
+                "message": templated,
+                "answer": templated,
+                "type": "quick_reply",
+                "session_id": session_id,
+                "user_question": user_question,
+                "success": True
+            }
+        }
+
+    guessed_intent = intent_classifier_agent.guess_intent(user_question, session_id)["intent"]
+    deferred_writer = _DeferredWriter()
+    speculation = asyncio.create_task(_run_agent_node(AGENT_NODES[guessed_intent], state, deferred_writer))
+
+    # If the question is ambiguous, the other likely agents warm their prompt prefix
+    # while the classifier decides, so a mismatch does not pay the full prefill again.
+    prefill_agents = ("career_coach_agent", "content_enhancer_agent")
+    prefill_tasks = {
+        intent: asyncio.create_task(get_agent(intent).warm_prefill(
+            state.get("profile", {}), state.get("job_description", ""), session_id
+        ))
+        for intent in intent_classifier_agent.candidate_intents(user_question)
+        if intent != guessed_intent and intent in prefill_agents
+    }
+
     try:
-        result = intent_classifier_agent.classify_intent(user_question, session_id)
+        result = await intent_classifier_agent.classify_intent(user_question, session_id)
         logger.info(f"Intent classified for session {session_id}: {result.get('intent')}")
-        return {"intent_classification": result}
     except Exception as e:
+        speculation.cancel()
+        for task in prefill_tasks.values():
+            task.cancel()
         logger.error(f"Intent classifier error for session {session_id}: {e}")
         return {"error": str(e)}
 
+    # The chosen agent's warm-up keeps running in the background; the others are moot
+    prefill_tasks.pop(result.get("intent"), None)
+    for task in prefill_tasks.values():
+        task.cancel()
+
+    if result.get("intent") == guessed_intent:
+        logger.info(f"Speculative {guessed_intent} confirmed for session {session_id}")
+        deferred_writer.release(writer)
+        return {"intent_classification": result, **(await speculation)}
+
+    speculation.cancel()
+    logger.info(f"Speculative {guessed_intent} discarded for session {session_id}")
+    return {"intent_classification": result}
+
 
 # --- Graph Construction ---
 def build_graph():
@@ -158,14 +446,20 @@ def build_graph():
     Builds the conversational multi-agent graph using LangGraph.
     This graph is now purely for orchestrating the conversation flow.
     """
+    # Build every agent now (the app calls this once per process, at profile load)
+    # so the first chat turn finds them ready in the pool instead of constructing them.
+    for name in AGENT_FACTORIES:
+        get_agent(name)
+
     graph = StateGraph(State)
 
     # Add each agent function as a node in the graph.
     graph.add_node("intent_classifier_agent", intent_classifier_node)
-    graph.add_node("profile_analyzer_agent", profile_analyzer_node)
-    graph.add_node("job_fit_agent", job_fit_node)
-    graph.add_node("content_enhancer_agent", content_enhancer_node)
-    graph.add_node("career_coach_agent", career_coach_node)
+    for intent, node in AGENT_NODES.items():
+        graph.add_node(intent, node)
+    # Compound questions fan out to several agents at once. The concurrency lives
+    # inside this one node rather than in parallel graph branches (Send).
+    graph.add_node("run_all_parallel", run_all_parallel)
 
     # The entry point for any new conversational turn is the intent classifier.
     graph.set_entry_point("intent_classifier_agent")
@@ -178,6 +472,8 @@ def build_graph():
     graph.add_conditional_edges("job_fit_agent", router)
     graph.add_conditional_edges("content_enhancer_agent", router)
     graph.add_conditional_edges("career_coach_agent", router)
+    graph.add_conditional_edges("run_all_parallel", router)
 
-    # Compile the graph, including a memory saver to persist state.
-    return graph.compile() 
+    # Compile the graph with a durable checkpointer so each session's state
+    # (keyed by thread_id = session_id) survives reloads and restarts.
+    return graph.compile(checkpointer=async_runtime.run(_open_checkpointer()))
@@ -3,12 +3,35 @@ from langgraph.graph import END
 import logging
 logger = logging.getLogger("router")
 
+# The state key each agent writes its output to
+AGENT_OUTPUT_KEYS = {
+    "profile_analyzer_agent": "analysis",
+    "job_fit_agent": "job_fit",
+    "content_enhancer_agent": "enhanced_content",
+    "career_coach_agent": "coaching",
+}
+
+# Nodes an intent may route to; anything else (e.g. a malformed LLM label) falls back to the coach
+_VALID_INTENTS = frozenset(AGENT_OUTPUT_KEYS)
+
+# Output key -> the agent that produced it, used to decide whether the current turn
+# already has a response
+_OUTPUT_TO_INTENT = {key: intent for intent, key in AGENT_OUTPUT_KEYS.items()}
+
+
+def has_answered(state: Dict[str, Any], intent: str) -> bool:
+    """True if the agent for `intent` has produced output for the current user question."""
+    output = state.get(AGENT_OUTPUT_KEYS[intent])
+    return bool(output) and output.get("user_question") == state.get("user_question")
+
+
 def router(state: Dict[str, Any]) -> Literal[
     "intent_classifier_agent",
     "profile_analyzer_agent",
     "job_fit_agent",
     "content_enhancer_agent",
-    "career_coach_agent"
+    "career_coach_agent",
+    "run_all_parallel"
 ] | type(END):
     """
     This is the central router function for the conversational graph.
@@ -21,32 +44,43 @@ def router(state: Dict[str, Any]) -> Literal[
     Returns:
         The string name of the next node to execute, or `END` to terminate the graph run.
     """
-    logger.info(f"Routing state: {state}")
+    # Formatting the whole state is costly and the router runs after every node
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Routing state: {state}")
 
     # --- Termination Conditions ---
     # If the state contains an error or an explicit end command, we terminate the flow.
-    if "error" in state or state.get("force_end"):
+    if state.get("error") or state.get("force_end"):
         return END
 
     # If an agent has just run and produced a response for the current user question,
     # the turn is considered complete, and the graph should finish its run.
     if state.get("command") == "chat":
-        if (
-            ("coaching" in state and state["coaching"] and state["coaching"].get("user_question") == state.get("user_question")) or
-            ("analysis" in state and state["analysis"] and state["analysis"].get("user_question") == state.get("user_question")) or
-            ("job_fit" in state and state["job_fit"] and state["job_fit"].get("user_question") == state.get("user_question")) or
-            ("enhanced_content" in state and state["enhanced_content"] and state["enhanced_content"].get("user_question") == state.get("user_question"))
-        ):
-            return END
+        # A compound question is complete only once every agent it asked for has answered;
+        # the missing ones run concurrently in a single fan-out node.
+        intents = [
+            intent for intent in (state.get("intent_classification") or {}).get("intents") or []
+            if intent in _VALID_INTENTS
+        ]
+        if len(intents) > 1:
+            if all(has_answered(state, intent) for intent in intents):
+                return END
+            logger.info(f"Routing to run_all_parallel for intents {intents}")
+            return "run_all_parallel"
+        user_question = state.get("user_question")
+        for key, producer in _OUTPUT_TO_INTENT.items():
+            output = state.get(key)
+            if output and output.get("user_question") == user_question:
+                logger.info(f"Turn answered by {producer}, ending")
+                return END
             
     # --- Intent-Based Routing ---
     # The graph's entry point is the intent classifier. After it runs, this router
     # uses its classification to direct the flow to the correct specialized agent.
-    if "intent_classification" in state and state["intent_classification"]:
-        intent = state["intent_classification"].get("intent")
-        if intent:
-            logger.info(f"Routing to {intent} based on intent classification")
-            return intent
+    intent = (state.get("intent_classification") or {}).get("intent")
+    if intent in _VALID_INTENTS:
+        logger.info(f"Routing to {intent} based on intent classification")
+        return intent
 
     # --- Fallback Route ---
     # If for any reason the intent is not classified correctly, we default to the
@@ -1,10 +1,18 @@
 import os
 import logging
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, Any, Optional, List
 from dotenv import load_dotenv
 import time
 import json
+import threading
+from concurrent.futures import Future
+import orjson
+from cachetools import TTLCache
+from functools import lru_cache
 import streamlit as st
 
 load_dotenv()
@@ -29,6 +37,28 @@ def _get_apify_token():
     
     return _APIFY_API_TOKEN
 
+@lru_cache(maxsize=2)
+def _get_session(retry: bool = True) -> requests.Session:
+    """
+    Shared HTTP session for all Apify calls: keeps connections to api.apify.com alive
+    across the polling loop, retries transient gateway errors on idempotent requests,
+    and sends the API token as a header instead of a query parameter.
+    `retry=False` returns a separate session without retries, for calls that must
+    finish within a deadline.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]) if retry else 0
+    ))
+    session.headers.update({"Authorization": f"Bearer {_get_apify_token()}"})
+    return session
+
+def _json(response: requests.Response) -> Any:
+    """Parse a response body with orjson straight from bytes; an empty body parses as {}."""
+    return orjson.loads(response.content) if response.content else {}
+
 # Updated actor list with more reliable LinkedIn scrapers
 POSSIBLE_ACTOR_IDS = [
     "2SyF0bVxmgGr8IVCZ",
@@ -38,47 +68,82 @@ POSSIBLE_ACTOR_IDS = [
 class LinkedInScraperError(Exception):
     pass
 
+# Actor schemas and the last actor that worked are persisted across restarts, so a
+# scrape normally starts the right actor with its first request instead of probing.
+SCRAPER_CACHE_PATH = os.path.expanduser(os.getenv("SCRAPER_CACHE_PATH", "~/.cache/linkedin_scraper/actors.json"))
+SCRAPER_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+def _read_disk_cache(key: str) -> Optional[Any]:
+    """Return a value persisted by `_write_disk_cache`, or None if it is missing or expired."""
+    try:
+        with open(SCRAPER_CACHE_PATH, encoding="utf-8") as f:
+            entry = json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+    if not entry or time.time() - entry.get("saved_at", 0) > SCRAPER_CACHE_TTL_SECONDS:
+        return None
+    return entry.get("value")
+
+def _write_disk_cache(key: str, value: Any) -> None:
+    """Persist a value under `key`; failures only cost a cache miss on the next run."""
+    try:
+        try:
+            with open(SCRAPER_CACHE_PATH, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        entries[key] = {"value": value, "saved_at": time.time()}
+        os.makedirs(os.path.dirname(SCRAPER_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{SCRAPER_CACHE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, SCRAPER_CACHE_PATH)
+    except OSError as e:
+        logger.warning(f"Failed to write scraper cache: {e}")
+
+# Compiled once at import: a profile URL, with or without "www." and anything after the slug
+_LINKEDIN_URL_RE = re.compile(r"^https://(?:www\.)?linkedin\.com/in/[A-Za-z0-9\-_%]+(?:/.*)?$")
+# Everything up to and including the "/in/" segment, and the profile slug that follows it
+_PROFILE_PATH_RE = re.compile(r"^(.*?/in/)([^/]*)")
+
 def validate_linkedin_url(url: str) -> bool:
     """Enhanced LinkedIn URL validation with better pattern matching."""
-    import re
-    
-    patterns = [
-        r"^https://(www\.)?linkedin\.com/in/[A-Za-z0-9\-_%]+/?$",
-        r"^https://(www\.)?linkedin\.com/in/[A-Za-z0-9\-_%]+/.*$",
-        r"^https://linkedin\.com/in/[A-Za-z0-9\-_%]+/?$"
-    ]
-    
-    url = url.strip()
-    for pattern in patterns:
-        if re.match(pattern, url):
-            return True
-    
-    return False
+    return _LINKEDIN_URL_RE.match(url.strip()) is not None
 
 def clean_linkedin_url(url: str) -> str:
     """Clean and normalize LinkedIn URL."""
     url = url.strip()
     
-    if '/in/' in url:
-        base_part = url.split('/in/')[0] + '/in/' + url.split('/in/')[1].split('/')[0]
-        if not base_part.endswith('/'):
-            base_part += '/'
-        return base_part
+    match = _PROFILE_PATH_RE.match(url)
+    if match:
+        return f"{match.group(1)}{match.group(2)}/"
     
     return url
 
+@lru_cache(maxsize=32)
+def _fetch_actor_input_schema(actor_id: str) -> Dict[str, Any]:
+    """
+    Fetch an actor's input schema, which is effectively static: cached in memory for
+    the process and on disk for SCRAPER_CACHE_TTL_SECONDS. Raises if the actor is not
+    accessible, so failures are never cached.
+    """
+    cached = _read_disk_cache(f"schema:{actor_id}")
+    if cached is not None:
+        return cached
+    response = _get_session().get(
+        f"https://api.apify.com/v2/acts/{actor_id}",
+        timeout=10
+    )
+    if response.status_code != 200:
+        raise LinkedInScraperError(f"Actor {actor_id} not accessible (status: {response.status_code})")
+    input_schema = _json(response).get('data', {}).get('defaultRunOptions', {}).get('inputSchema', {})
+    _write_disk_cache(f"schema:{actor_id}", input_schema)
+    return input_schema
+
 def get_actor_input_schema(actor_id: str) -> Dict[str, Any]:
     """Get the input schema for a specific actor."""
     try:
-        response = requests.get(
-            f"https://api.apify.com/v2/acts/{actor_id}?token={_get_apify_token()}",
-            timeout=10
-        )
-        if response.status_code == 200:
-            actor_data = response.json()
-            input_schema = actor_data.get('data', {}).get('defaultRunOptions', {}).get('inputSchema', {})
-            return input_schema
-        return {}
+        return _fetch_actor_input_schema(actor_id)
     except Exception as e:
         logger.warning(f"Failed to get input schema for {actor_id}: {e}")
         return {}
@@ -109,15 +174,15 @@ def test_actor_with_payload(actor_id: str, payload: Dict[str, Any]) -> Dict[str,
     """Test an actor with a specific payload format."""
     try:
         # First, validate the payload by starting a test run
-        test_url = f"https://api.apify.com/v2/acts/{actor_id}/runs?token={_get_apify_token()}"
+        test_url = f"https://api.apify.com/v2/acts/{actor_id}/runs"
         headers = {"Content-Type": "application/json"}
         
         logger.info(f"Testing actor {actor_id} with payload: {json.dumps(payload, indent=2)}")
         
-        response = requests.post(test_url, json=payload, headers=headers, timeout=30)
+        response = _get_session().post(test_url, data=orjson.dumps(payload), headers=headers, timeout=30)
         
         if response.status_code == 201:
-            run_data = response.json()
+            run_data = _json(response)
             run_id = run_data.get("data", {}).get("id")
             logger.info(f"✅ Actor {actor_id} accepted payload. Run ID: {run_id}")
             return {
@@ -127,7 +192,7 @@ def test_actor_with_payload(actor_id: str, payload: Dict[str, Any]) -> Dict[str,
                 'payload': payload
             }
         else:
-            error_data = response.json() if response.content else {}
+            error_data = _json(response)
             logger.warning(f"❌ Actor {actor_id} rejected payload. Status: {response.status_code}")
             logger.warning(f"Error: {error_data}")
             return {
@@ -147,18 +212,19 @@ def find_working_actor_and_payload(linkedin_url: str) -> Dict[str, Any]:
     if not _get_apify_token():
         raise LinkedInScraperError("APIFY_API_TOKEN not set in environment")
     
-    for actor_id in POSSIBLE_ACTOR_IDS:
+    # Try the actor that worked last time first, so discovery usually ends on the first request
+    last_working = _read_disk_cache("last_working_actor")
+    actor_ids = sorted(POSSIBLE_ACTOR_IDS, key=lambda actor_id: actor_id != last_working)
+    
+    for actor_id in actor_ids:
         logger.info(f"🔍 Testing actor: {actor_id}")
         
-        # Test if actor exists
+        # Test if actor exists (the schema lookup is cached, and reused for the payload below)
         try:
-            response = requests.get(
-                f"https://api.apify.com/v2/acts/{actor_id}?token={_get_apify_token()}",
-                timeout=10
-            )
-            if response.status_code != 200:
-                logger.warning(f"Actor {actor_id} not accessible (status: {response.status_code})")
-                continue
+            _fetch_actor_input_schema(actor_id)
+        except LinkedInScraperError as e:
+            logger.warning(str(e))
+            continue
         except Exception as e:
             logger.warning(f"Failed to check actor {actor_id}: {e}")
             continue
@@ -169,6 +235,8 @@ def find_working_actor_and_payload(linkedin_url: str) -> Dict[str, Any]:
         # Test the payload
         result = test_actor_with_payload(actor_id, payload)
         if result.get('success'):
+            if actor_id != last_working:
+                _write_disk_cache("last_working_actor", actor_id)
             return result
     
     raise LinkedInScraperError(
@@ -182,13 +250,13 @@ def find_working_actor_and_payload(linkedin_url: str) -> Dict[str, Any]:
 def get_run_dataset_id(actor_id: str, run_id: str) -> Optional[str]:
     """Get the default dataset ID for a run."""
     try:
-        response = requests.get(
-            f"https://api.apify.com/v2/acts/{actor_id}/runs/{run_id}?token={_get_apify_token()}",
+        response = _get_session().get(
+            f"https://api.apify.com/v2/acts/{actor_id}/runs/{run_id}",
             timeout=30
         )
         response.raise_for_status()
         
-        run_data = response.json()
+        run_data = _json(response)
         dataset_id = run_data.get("data", {}).get("defaultDatasetId")
         logger.info(f"Found dataset ID: {dataset_id}")
         return dataset_id
@@ -197,28 +265,40 @@ def get_run_dataset_id(actor_id: str, run_id: str) -> Optional[str]:
         logger.error(f"Failed to get dataset ID: {e}")
         return None
 
+# Status polling: one server-side long poll, then client-side backoff from 1 s up to 15 s
+WAIT_FOR_FINISH_SECONDS = 30
+POLL_INTERVAL_START = 1.0
+POLL_INTERVAL_MAX = 15.0
+
 def wait_for_run_completion(actor_id: str, run_id: str, max_wait: int = 180) -> Dict[str, Any]:
     """Wait for a run to complete and return results."""
     
-    wait_time = 0
-    poll_interval = 10
+    # A monotonic deadline keeps max_wait a real bound: the time spent in HTTP calls counts too
+    started = time.monotonic()
+    deadline = started + max_wait
+    poll_interval = POLL_INTERVAL_START
+    # The first status request long-polls: Apify holds it open until the run finishes
+    # (or waitForFinish seconds pass), so most runs need a single status call.
+    wait_for_finish = min(WAIT_FOR_FINISH_SECONDS, max_wait)
     
-    while wait_time < max_wait:
-        time.sleep(poll_interval)
-        wait_time += poll_interval
-        
+    while time.monotonic() < deadline:
         try:
-            # Check run status
-            status_response = requests.get(
-                f"https://api.apify.com/v2/acts/{actor_id}/runs/{run_id}?token={_get_apify_token()}",
-                timeout=30
+            # Check run status. The call may not outlive the deadline: its timeout is clamped to
+            # the time left, and it is not retried (the loop itself polls again).
+            remaining = deadline - time.monotonic()
+            wait_for_finish = min(wait_for_finish, int(remaining))
+            status_response = _get_session(retry=False).get(
+                f"https://api.apify.com/v2/acts/{actor_id}/runs/{run_id}",
+                params={"waitForFinish": wait_for_finish} if wait_for_finish else None,
+                timeout=max(1.0, min(30 + wait_for_finish, remaining))
             )
+            wait_for_finish = 0
             status_response.raise_for_status()
             
-            status_data = status_response.json()
+            status_data = _json(status_response)
             run_status = status_data.get("data", {}).get("status")
             
-            logger.info(f"Run {run_id} status after {wait_time}s: {run_status}")
+            logger.info(f"Run {run_id} status after {time.monotonic() - started:.0f}s: {run_status}")
             
             if run_status == "SUCCEEDED":
                 # Get the dataset ID from the run data
@@ -232,17 +312,17 @@ def wait_for_run_completion(actor_id: str, run_id: str, max_wait: int = 180) ->
                 
                 # Try multiple dataset URL formats
                 dataset_urls = [
-                    f"https://api.apify.com/v2/datasets/{dataset_id}/items?token={_get_apify_token()}",
-                    f"https://api.apify.com/v2/acts/{actor_id}/runs/{run_id}/dataset/items?token={_get_apify_token()}",
+                    f"https://api.apify.com/v2/datasets/{dataset_id}/items",
+                    f"https://api.apify.com/v2/acts/{actor_id}/runs/{run_id}/dataset/items",
                 ]
                 
                 for dataset_url in dataset_urls:
                     try:
                         logger.info(f"Trying dataset URL: {dataset_url}")
-                        results_response = requests.get(dataset_url, timeout=30)
+                        results_response = _get_session().get(dataset_url, timeout=30)
                         
                         if results_response.status_code == 200:
-                            data = results_response.json()
+                            data = _json(results_response)
                             if data and isinstance(data, list) and len(data) > 0:
                                 logger.info(f"✅ Got {len(data)} results from dataset")
                                 return {'success': True, 'data': data[0]}
@@ -269,42 +349,49 @@ def wait_for_run_completion(actor_id: str, run_id: str, max_wait: int = 180) ->
         
         except Exception as e:
             logger.error(f"Error checking run status: {e}")
+        
+        # Still running: fall back to client-side polling with exponential backoff
+        time.sleep(max(0.0, min(poll_interval, deadline - time.monotonic())))
+        poll_interval = min(POLL_INTERVAL_MAX, poll_interval * 1.5)
             
     return {'success': False, 'error': f'Run timed out after {max_wait} seconds'}
 
+# Profile field -> the scraper output keys it may come from, in order of preference
+_FIELD_MAPPINGS = {
+    "name": ["fullName", "firstName", "lastName", "name"],
+    "headline": ["headline", "title"],
+    "about": ["about", "summary", "description"],
+    "experience": ["experience", "positions", "workExperience"],
+    "education": ["education", "schools"],
+    "skills": ["skills", "skillsAndEndorsements"],
+    "certifications": ["certifications", "certificates"],
+    "languages": ["languages", "spokenLanguages"],
+    "location": ["location", "locationName"],
+    "profileUrl": ["profileUrl", "url", "linkedinUrl"]
+}
+# Inverted once at import: source key -> (profile field, preference rank)
+_SOURCE_TO_TARGET = {
+    source: (target, rank)
+    for target, sources in _FIELD_MAPPINGS.items()
+    for rank, source in enumerate(sources)
+}
+_LIST_FIELDS = frozenset({"experience", "education", "skills", "certifications", "languages"})
+
 def sanitize_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
     """Enhanced profile sanitization with better error handling."""
     
-    field_mappings = {
-        "name": ["fullName", "firstName", "lastName", "name"],
-        "headline": ["headline", "title"],
-        "about": ["about", "summary", "description"],
-        "experience": ["experience", "positions", "workExperience"],
-        "education": ["education", "schools"],
-        "skills": ["skills", "skillsAndEndorsements"],
-        "certifications": ["certifications", "certificates"],
-        "languages": ["languages", "spokenLanguages"],
-        "location": ["location", "locationName"],
-        "profileUrl": ["profileUrl", "url", "linkedinUrl"]
-    }
-    
-    sanitized = {}
+    sanitized = {key: ([] if key in _LIST_FIELDS else "") for key in _FIELD_MAPPINGS}
+    filled_ranks = {}
     
-    for target_key, possible_keys in field_mappings.items():
-        value = None
-        
-        for key in possible_keys:
-            if key in profile and profile[key]:
-                value = profile[key]
-                break
-        
-        if value is None:
-            if target_key in ["experience", "education", "skills", "certifications", "languages"]:
-                sanitized[target_key] = []
-            else:
-                sanitized[target_key] = ""
-        else:
+    # Single pass over the scraped keys; a non-empty value replaces one from a less preferred key
+    for key, value in profile.items():
+        mapped = _SOURCE_TO_TARGET.get(key)
+        if mapped is None or not value:
+            continue
+        target_key, rank = mapped
+        if rank < filled_ranks.get(target_key, len(_SOURCE_TO_TARGET)):
             sanitized[target_key] = value
+            filled_ranks[target_key] = rank
     
     # Handle name combination if needed
     if not sanitized["name"] and "firstName" in profile:
@@ -314,6 +401,13 @@ def sanitize_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
     
     return sanitized
 
+# Completed scrapes are reused for SCRAPE_CACHE_TTL_SECONDS, and concurrent requests for the
+# same profile (other sessions or tabs) wait for the one Apify run already in flight.
+SCRAPE_CACHE_TTL_SECONDS = 10 * 60
+_SCRAPE_CACHE: "TTLCache[str, Dict[str, Any]]" = TTLCache(maxsize=128, ttl=SCRAPE_CACHE_TTL_SECONDS)
+_INFLIGHT: Dict[str, Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
 def fetch_linkedin_profile(linkedin_url: str) -> Dict[str, Any]:
     """Main function to fetch LinkedIn profile with improved error handling."""
     
@@ -321,6 +415,40 @@ def fetch_linkedin_profile(linkedin_url: str) -> Dict[str, Any]:
         raise LinkedInScraperError("Invalid LinkedIn profile URL")
     
     cleaned_url = clean_linkedin_url(linkedin_url)
+    
+    with _INFLIGHT_LOCK:
+        cached = _SCRAPE_CACHE.get(cleaned_url)
+        if cached is not None:
+            logger.info(f"Using cached scrape for: {cleaned_url}")
+            # Callers annotate the profile, so each gets its own copy
+            return dict(cached)
+        future = _INFLIGHT.get(cleaned_url)
+        is_owner = future is None
+        if is_owner:
+            future = _INFLIGHT[cleaned_url] = Future()
+    
+    if not is_owner:
+        logger.info(f"Joining in-flight scrape for: {cleaned_url}")
+        return dict(future.result())
+    
+    try:
+        profile = _scrape_profile(cleaned_url)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        # An empty result (e.g. a private profile) is not cached, so a retry scrapes again
+        if profile.get("name"):
+            with _INFLIGHT_LOCK:
+                _SCRAPE_CACHE[cleaned_url] = profile
+        future.set_result(profile)
+        return dict(profile)
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(cleaned_url, None)
+
+def _scrape_profile(cleaned_url: str) -> Dict[str, Any]:
+    """Run an Apify actor for the profile and return the sanitized result."""
     logger.info(f"🚀 Starting LinkedIn profile scrape for: {cleaned_url}")
     
     # Find working actor and payload
@@ -1,5 +1,4 @@
-from typing import TypedDict, Optional, Dict, Any, List
-from langgraph.checkpoint.memory import MemorySaver
+from typing import TypedDict, Optional, Dict, Any, List, Sequence
 
 def chat_history_reducer(old_history: List[Dict], new_history: List[Dict]) -> List[Dict]:
     """Custom reducer to keep chat history as simple dictionaries."""
@@ -38,11 +37,13 @@ class State(TypedDict):
     enhanced_content: Optional[Dict[str, Any]]
     coaching: Optional[Dict[str, Any]]
 
-    # Conversation context - simple list of dictionaries with custom reducer
-    chat_history: List[Dict[str, str]]
+    # Routing - the classifier's result for the current turn ("intent", plus "intents"
+    # for compound questions); declared so nodes and the final state can read it
+    intent_classification: Optional[Dict[str, Any]]
 
-    # Error handling
-    error: Optional[str]
+    # Conversation context - the session's most recent messages as simple dictionaries
+    # (a bounded deque in the app, already truncated for prompt use)
+    chat_history: Sequence[Dict[str, str]]
 
-# Create memory saver instance
-memory_saver = MemorySaver()
\ No newline at end of file
+    # Error handling
+    error: Optional[str]
\ No newline at end of file